@@ -0,0 +1,43 @@
+"""add (item_id, sale_date) index on sales
+
+Revision ID: 0001_sales_item_date_index
+Revises:
+Create Date: 2026-10-18 12:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001_sales_item_date_index"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEX_NAME = "ix_sales_item_id_sale_date"
+
+
+def _sales_indexes():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("sales"):
+        return None
+    return {index["name"] for index in inspector.get_indexes("sales")}
+
+
+def upgrade() -> None:
+    # Таблицы создаёт init_db.py через create_all, поэтому индекс
+    # может уже существовать или таблицы ещё может не быть
+    indexes = _sales_indexes()
+    if indexes is None or INDEX_NAME in indexes:
+        return
+    op.create_index(INDEX_NAME, "sales", ["item_id", "sale_date"])
+
+
+def downgrade() -> None:
+    indexes = _sales_indexes()
+    if indexes is None or INDEX_NAME not in indexes:
+        return
+    op.drop_index(INDEX_NAME, table_name="sales")
@@ -0,0 +1,46 @@
+"""add materialized forecasts table
+
+Revision ID: 0002_forecasts_table
+Revises: 0001_sales_item_date_index
+Create Date: 2026-10-18 14:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002_forecasts_table"
+down_revision: Union[str, None] = "0001_sales_item_date_index"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # init_db.py мог уже создать таблицу через create_all
+    if sa.inspect(op.get_bind()).has_table("forecasts"):
+        return
+    op.create_table(
+        "forecasts",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("item_id", sa.Integer(), nullable=False),
+        sa.Column("target_date", sa.Date(), nullable=False),
+        sa.Column("predicted_quantity", sa.Float(), nullable=False),
+        sa.Column("model_version", sa.String(length=100), nullable=False),
+        sa.Column(
+            "generated_at", sa.DateTime(timezone=True), nullable=False
+        ),
+        sa.UniqueConstraint(
+            "item_id", "target_date", name="unique_forecast_item_date"
+        ),
+    )
+    op.create_index("ix_forecasts_id", "forecasts", ["id"])
+
+
+def downgrade() -> None:
+    if not sa.inspect(op.get_bind()).has_table("forecasts"):
+        return
+    op.drop_index("ix_forecasts_id", table_name="forecasts")
+    op.drop_table("forecasts")
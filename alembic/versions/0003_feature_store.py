@@ -0,0 +1,54 @@
+"""add incremental feature store tables
+
+Revision ID: 0003_feature_store
+Revises: 0002_forecasts_table
+Create Date: 2026-10-18 16:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003_feature_store"
+down_revision: Union[str, None] = "0002_forecasts_table"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # init_db.py мог уже создать таблицы через create_all
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("sales_features"):
+        op.create_table(
+            "sales_features",
+            sa.Column("item_id", sa.Integer(), primary_key=True),
+            sa.Column("sale_date", sa.Date(), primary_key=True),
+            sa.Column("quantity", sa.Integer(), nullable=False),
+            sa.Column("month_sin", sa.Float(), nullable=False),
+            sa.Column("month_cos", sa.Float(), nullable=False),
+            sa.Column("weekday_sin", sa.Float(), nullable=False),
+            sa.Column("weekday_cos", sa.Float(), nullable=False),
+            sa.Column("lag_1", sa.Float()),
+            sa.Column("lag_3", sa.Float()),
+            sa.Column("lag_7", sa.Float()),
+            sa.Column("lag_14", sa.Float()),
+        )
+    if not inspector.has_table("feature_store_items"):
+        op.create_table(
+            "feature_store_items",
+            sa.Column("item_id", sa.Integer(), primary_key=True),
+            sa.Column("last_date", sa.Date(), nullable=False),
+            sa.Column("row_count", sa.Integer(), nullable=False),
+            sa.Column("quantity_total", sa.BigInteger(), nullable=False),
+            sa.Column("tail", sa.String(), nullable=False),
+        )
+
+
+def downgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for table in ("feature_store_items", "sales_features"):
+        if inspector.has_table(table):
+            op.drop_table(table)
@@ -1,11 +1,16 @@
+import os
+
 from fastapi import Depends, HTTPException, status, APIRouter, Request
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from passlib.context import CryptContext
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
 from models import UserModel
-from database import get_db
+from database import get_async_db, get_db
+from metrics import timed
 from schemas import UserCreate
 
 
@@ -13,12 +18,23 @@ SECRET_KEY = "my_super_puper_key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# claims: роли берутся из подписанного токена без запросов к БД, поэтому
+# кэш пользователей не нужен; изменения ролей вступают в силу со следующим
+# токеном. db: пользователь и роли читаются из БД на каждый запрос
+AUTH_MODE = os.environ.get("AUTH_MODE", "claims")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 router = APIRouter()
 bcrypt = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+class TokenUser:
+    def __init__(self, username, roles):
+        self.username = username
+        self.roles = list(roles)
+
+
 def create_user(db: Session, user_create: UserCreate) -> UserModel:
     user = UserModel(
         username=user_create.username,
@@ -38,6 +54,15 @@ def get_user(db: Session, username: str):
     return db.query(UserModel).filter(UserModel.username == username).first()
 
 
+async def get_user_async(db: AsyncSession, username: str):
+    result = await db.execute(
+        select(UserModel)
+        .options(selectinload(UserModel.roles))
+        .where(UserModel.username == username)
+    )
+    return result.scalar_one_or_none()
+
+
 def authenticate_user(db: Session, username: str, password: str):
     user = get_user(db, username)
     if not user or not user.check_password(password):
@@ -45,8 +70,15 @@ def authenticate_user(db: Session, username: str, password: str):
     return user
 
 
-def get_user_roles(user: UserModel):
-    return [role.name for role in user.roles]
+def get_user_roles(user: UserModel | TokenUser):
+    # У TokenUser роли уже строки из токена
+    return [getattr(role, "name", role) for role in user.roles]
+
+
+def grant_role(db: Session, user: UserModel, role):
+    if role not in user.roles:
+        user.roles.append(role)
+        db.commit()
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
@@ -60,25 +92,26 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-def get_current_user(request: Request, db: Session = Depends(get_db)):
+def decode_token(request: Request):
     token = request.cookies.get("access_token")
     if not token:
         return None
-
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Неверные учетные данные",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-        user = get_user(db, username)
-        if user is None:
-            return None
-        return user
     except JWTError:
         return None
+    if payload.get("sub") is None:
+        return None
+    return payload
+
+
+async def get_current_user(
+    request: Request, db: AsyncSession = Depends(get_async_db)
+):
+    payload = decode_token(request)
+    if payload is None:
+        return None
+    if AUTH_MODE == "claims":
+        return TokenUser(payload["sub"], payload.get("roles", []))
+    with timed("auth_db_lookup"):
+        return await get_user_async(db, payload["sub"])
@@ -0,0 +1,97 @@
+import importlib
+import os
+import threading
+from abc import ABC, abstractmethod
+
+
+FORECAST_BACKEND = os.environ.get(
+    "FORECAST_BACKEND", "training:training_queue"
+)
+FORECAST_PRELOAD = os.environ.get("FORECAST_PRELOAD", "0") == "1"
+
+
+class ForecastBackend(ABC):
+    @abstractmethod
+    def item_versions(self, db_session, item_ids):
+        ...
+
+    @abstractmethod
+    def item_forecasts(self, db_session, item_ids, forecast_days=None):
+        ...
+
+    @abstractmethod
+    def mark_dirty(self, item_id):
+        ...
+
+    @abstractmethod
+    def enqueue(self, item_ids=None):
+        ...
+
+    @abstractmethod
+    def pending(self):
+        ...
+
+    @abstractmethod
+    def job_status(self, job_id):
+        ...
+
+
+class LazyBackend(ForecastBackend):
+    def __init__(self, target=FORECAST_BACKEND):
+        # target в формате "модуль:атрибут", модуль импортируется только
+        # при первом обращении к прогнозам
+        self.target = target
+        self._backend = None
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._backend is not None
+
+    def load(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    module_name, _, attribute = self.target.partition(":")
+                    module = importlib.import_module(module_name)
+                    backend = getattr(module, attribute)
+                    for item_id in sorted(self._dirty):
+                        backend.mark_dirty(item_id)
+                    self._dirty.clear()
+                    self._backend = backend
+        return self._backend
+
+    def item_versions(self, db_session, item_ids):
+        return self.load().item_versions(db_session, item_ids)
+
+    def item_forecasts(self, db_session, item_ids, forecast_days=None):
+        return self.load().item_forecasts(
+            db_session, item_ids, forecast_days
+        )
+
+    def mark_dirty(self, item_id):
+        # Запись продажи не должна тянуть за собой загрузку бэкенда
+        with self._lock:
+            if self._backend is None:
+                self._dirty.add(int(item_id))
+                return
+        self._backend.mark_dirty(item_id)
+
+    def enqueue(self, item_ids=None):
+        return self.load().enqueue(item_ids)
+
+    def pending(self):
+        if not self.loaded:
+            with self._lock:
+                return sorted(self._dirty)
+        return self._backend.pending()
+
+    def job_status(self, job_id):
+        return self.load().job_status(job_id)
+
+
+forecast_backend = LazyBackend()
+
+if FORECAST_PRELOAD:
+    forecast_backend.load()
@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import json
+import time
+
+from httpx import ASGITransport, AsyncClient
+
+from database import SessionLocal
+from main import app
+from models import UserModel
+
+
+BENCH_USER = "bench_user"
+BENCH_PASSWORD = "bench_password"
+
+
+def ensure_user():
+    db = SessionLocal()
+    try:
+        if not db.query(UserModel).filter_by(username=BENCH_USER).first():
+            user = UserModel(username=BENCH_USER, email="bench@example.com")
+            user.set_password(BENCH_PASSWORD)
+            db.add(user)
+            db.commit()
+    finally:
+        db.close()
+
+
+async def run_scenario(client, name, clients, requests_per_client, cookies):
+    async def request():
+        if name == "login":
+            return await client.post(
+                "/login",
+                data={"username": BENCH_USER, "password": BENCH_PASSWORD},
+            )
+        return await client.get("/", cookies=cookies)
+
+    latencies = []
+
+    async def worker():
+        for _ in range(requests_per_client):
+            started = time.perf_counter()
+            response = await request()
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code in (200, 303), response.status_code
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "clients": clients,
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 1),
+    }
+
+
+async def main(url, clients, requests_per_client, scenarios):
+    transport = None if url else ASGITransport(app)
+    async with AsyncClient(
+        transport=transport, base_url=url or "http://testserver"
+    ) as client:
+        response = await client.post(
+            "/login", data={"username": BENCH_USER, "password": BENCH_PASSWORD}
+        )
+        cookies = {"access_token": response.cookies.get("access_token")}
+        return [
+            await run_scenario(
+                client, name, clients, requests_per_client, cookies
+            )
+            for name in scenarios
+        ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Пропускная способность /login и / под нагрузкой"
+    )
+    parser.add_argument("--url", help="адрес запущенного сервера")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--scenarios", nargs="+", default=["login", "root"])
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    ensure_user()
+    results = asyncio.run(
+        main(args.url, args.clients, args.requests, args.scenarios)
+    )
+    for result in results:
+        print(
+            f"{result['scenario']:<6} {result['clients']:>4} клиентов "
+            f"{result['requests_per_second']:8.1f} rps  "
+            f"p50={result['p50_ms']} мс  p99={result['p99_ms']} мс"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
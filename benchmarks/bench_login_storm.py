@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import json
+import time
+
+from httpx import ASGITransport, AsyncClient
+
+from benchmarks.bench_concurrency import (
+    BENCH_PASSWORD,
+    BENCH_USER,
+    ensure_user,
+)
+from main import app
+
+
+async def storm(client, logins, page_clients, page_path):
+    outcomes = {}
+    page_latencies = []
+    storm_done = asyncio.Event()
+
+    async def login():
+        response = await client.post(
+            "/login", data={"username": BENCH_USER, "password": BENCH_PASSWORD}
+        )
+        status_code = response.status_code
+        outcomes[status_code] = outcomes.get(status_code, 0) + 1
+
+    async def page_reader():
+        # Лёгкие страницы должны отвечать быстро, пока идёт шторм логинов
+        while not storm_done.is_set():
+            started = time.perf_counter()
+            await client.get(page_path)
+            page_latencies.append(time.perf_counter() - started)
+
+    readers = [asyncio.create_task(page_reader()) for _ in range(page_clients)]
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    storm_done.set()
+    await asyncio.gather(*readers)
+
+    page_latencies.sort()
+    return {
+        "logins": logins,
+        "storm_seconds": round(elapsed, 2),
+        "login_status_counts": outcomes,
+        "page_requests": len(page_latencies),
+        "page_p50_ms": round(
+            page_latencies[len(page_latencies) // 2] * 1000, 1
+        ),
+        "page_p99_ms": round(
+            page_latencies[int(len(page_latencies) * 0.99)] * 1000, 1
+        ),
+    }
+
+
+async def main(logins, page_clients, page_path):
+    async with AsyncClient(
+        transport=ASGITransport(app), base_url="http://testserver"
+    ) as client:
+        return await storm(client, logins, page_clients, page_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Задержка страниц во время шторма логинов"
+    )
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--page-clients", type=int, default=5)
+    parser.add_argument("--page-path", default="/register")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    ensure_user()
+    result = asyncio.run(main(args.logins, args.page_clients, args.page_path))
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
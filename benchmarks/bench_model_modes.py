@@ -0,0 +1,46 @@
+import argparse
+import json
+import tempfile
+import time
+
+from forecasting import ModelRegistry, forecast_with_dynamic_features
+from benchmarks.synthetic import generate_sales, sqlite_session
+
+
+def run(item_counts, days, modes):
+    results = []
+    for n_items in item_counts:
+        db = sqlite_session(generate_sales(n_items, days))
+        for mode in modes:
+            with tempfile.TemporaryDirectory() as registry_dir:
+                started = time.perf_counter()
+                forecast_with_dynamic_features(
+                    db, registry=ModelRegistry(registry_dir), mode=mode
+                )
+                elapsed = time.perf_counter() - started
+            results.append(
+                {"items": n_items, "mode": mode, "seconds": round(elapsed, 3)}
+            )
+            print(f"{n_items:>6} товаров  {mode:<9} {elapsed:9.2f} с")
+        db.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Время обучения и прогноза в разных режимах моделей"
+    )
+    parser.add_argument(
+        "--items", type=int, nargs="+", default=[10, 100, 1000]
+    )
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument(
+        "--modes", nargs="+", default=["per_item", "batched", "global"]
+    )
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    results = run(args.items, args.days, args.modes)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
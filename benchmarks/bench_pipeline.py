@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.synthetic import generate_sales, sqlite_session
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def stage(seconds, count=None, **extra):
+    result = {"seconds": round(seconds, 4)}
+    if count:
+        result["per_item_ms"] = round(seconds / count * 1000, 2)
+    result.update(extra)
+    return result
+
+
+def run_pipeline(frame, sample_items, seed):
+    from forecasting import (
+        FORECAST_DAYS,
+        forecast_item_sales,
+        load_sales_frame,
+        load_training_frame,
+        preprocess_item_data,
+        train_item_model,
+    )
+
+    stages = {}
+    db = sqlite_session(frame)
+    try:
+        started = time.perf_counter()
+        data = load_sales_frame(db)
+        stages["db_load"] = stage(
+            time.perf_counter() - started, rows=len(data)
+        )
+
+        # Первый прогон пишет снимок целиком, второй читает его с диска
+        snapshot = os.path.join(os.environ["MODEL_REGISTRY_DIR"], "snapshot")
+        for name in ("snapshot_build", "snapshot_load"):
+            started = time.perf_counter()
+            load_training_frame(db, snapshot=snapshot)
+            stages[name] = stage(time.perf_counter() - started)
+    finally:
+        db.close()
+
+    items = sorted(data["item_id"].unique())[:sample_items]
+    item_frames = {
+        item: data.loc[data["item_id"] == item, ["sale_date", "quantity"]]
+        for item in items
+    }
+
+    prepared = {}
+    started = time.perf_counter()
+    for item in items:
+        prepared[item] = preprocess_item_data(item_frames[item].copy())
+    stages["preprocess"] = stage(time.perf_counter() - started, len(items))
+
+    models = {}
+    epochs = []
+    started = time.perf_counter()
+    for item in items:
+        X, y, _ = prepared[item]
+        report = {}
+        models[item] = train_item_model(X, y, seed=seed, report=report)
+        epochs.append(report["epochs"])
+    stages["train"] = stage(
+        time.perf_counter() - started,
+        len(items),
+        mean_epochs=round(sum(epochs) / len(epochs), 1),
+    )
+
+    started = time.perf_counter()
+    for item in items:
+        model, scaler = models[item]
+        forecast_item_sales(
+            model,
+            scaler,
+            item_frames[item],
+            FORECAST_DAYS,
+            prepared[item][2],
+        )
+    stages["forecast"] = stage(time.perf_counter() - started, len(items))
+    return stages
+
+
+async def run_http(requests):
+    # Приложение открывает собственные соединения, поэтому HTTP-часть
+    # работает с временным файлом SQLite, заданным в DATABASE_URL
+    from httpx import ASGITransport, AsyncClient
+
+    from main import app
+
+    stages = {}
+    async with AsyncClient(
+        transport=ASGITransport(app), base_url="http://testserver"
+    ) as client:
+        latencies = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = await client.get("/")
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.status_code
+        latencies.sort()
+        stages["get_root"] = stage(
+            sum(latencies),
+            p50_ms=round(latencies[len(latencies) // 2] * 1000, 2),
+            requests=requests,
+        )
+
+        params = {"item_id": 1}
+        for name in ("get_forecast_cold", "get_forecast_warm"):
+            started = time.perf_counter()
+            response = await client.get("/api/forecast", params=params)
+            stages[name] = stage(time.perf_counter() - started)
+            assert response.status_code == 200, response.status_code
+
+        started = time.perf_counter()
+        response = await client.get(
+            "/api/forecast",
+            params=params,
+            headers={"If-None-Match": response.headers["etag"]},
+        )
+        stages["get_forecast_304"] = stage(time.perf_counter() - started)
+        assert response.status_code == 304, response.status_code
+    return stages
+
+
+def compare(current, baseline):
+    print(f"{'этап':<20} {'было, с':>10} {'стало, с':>10} {'x':>7}")
+    for name, result in current["stages"].items():
+        previous = baseline["stages"].get(name)
+        if previous is None:
+            continue
+        ratio = result["seconds"] / max(previous["seconds"], 1e-9)
+        print(
+            f"{name:<20} {previous['seconds']:>10.4f} "
+            f"{result['seconds']:>10.4f} {ratio:>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Время этапов прогноза и HTTP на синтетических продажах"
+    )
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--sparsity", type=float, default=0.0)
+    parser.add_argument("--seasonality", type=float, default=0.3)
+    parser.add_argument("--yearly-seasonality", type=float, default=0.0)
+    parser.add_argument("--sample-items", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--output")
+    parser.add_argument("--compare", help="JSON прошлого прогона")
+    args = parser.parse_args()
+
+    frame = generate_sales(
+        args.items,
+        args.days,
+        seed=args.seed,
+        sparsity=args.sparsity,
+        seasonality=args.seasonality,
+        yearly_seasonality=args.yearly_seasonality,
+    )
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database_url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        os.environ["DATABASE_URL"] = database_url
+        os.environ["MODEL_REGISTRY_DIR"] = os.path.join(workdir, "models")
+
+        stages = run_pipeline(frame, args.sample_items, args.seed)
+        if not args.skip_http:
+            sqlite_session(frame, database_url).close()
+            stages.update(asyncio.run(run_http(args.requests)))
+
+    result = {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "compare")
+        },
+        "rows": len(frame),
+        "stages": stages,
+    }
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
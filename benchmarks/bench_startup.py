@@ -0,0 +1,58 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    "import_seconds": round(elapsed, 3),
+    "max_rss_mb": round(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+    ),
+    "pandas_loaded": "pandas" in sys.modules,
+    "tensorflow_loaded": "tensorflow" in sys.modules,
+}))
+"""
+
+
+def measure(preload, repeats):
+    env = dict(os.environ, FORECAST_PRELOAD="1" if preload else "0")
+    env.setdefault("DATABASE_URL", "sqlite://")
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    best = min(runs, key=lambda run: run["import_seconds"])
+    return {"mode": "eager" if preload else "lazy", **best}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Время импорта и RSS main:app с ленивым бэкендом и без"
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    results = [measure(preload, args.repeats) for preload in (True, False)]
+    for result in results:
+        print(
+            f"{result['mode']:<6} {result['import_seconds']:6.3f} с "
+            f"{result['max_rss_mb']:8.1f} МБ  "
+            f"pandas={result['pandas_loaded']}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,52 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, Sale
+
+
+def generate_sales(
+    n_items,
+    n_days,
+    start=date(2024, 1, 1),
+    seed=0,
+    sparsity=0.0,
+    seasonality=0.3,
+    yearly_seasonality=0.0,
+):
+    # sparsity — доля пропущенных дней продаж товара,
+    # seasonality — амплитуда недельного цикла
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start=start, periods=n_days, freq="D")
+    item_ids = np.repeat(np.arange(1, n_items + 1), n_days)
+    sale_dates = pd.DatetimeIndex(np.tile(dates, n_items))
+
+    base = np.repeat(rng.uniform(2, 20, size=n_items), n_days)
+    weekly = 1 + seasonality * np.sin(2 * np.pi * sale_dates.dayofweek / 7)
+    yearly = 1 + yearly_seasonality * np.sin(
+        2 * np.pi * sale_dates.dayofyear / 365
+    )
+    quantity = rng.poisson(base * weekly * yearly)
+
+    frame = pd.DataFrame(
+        {
+            "item_id": item_ids,
+            "sale_date": sale_dates.date,
+            "quantity": quantity.astype(int),
+        }
+    )
+    if sparsity:
+        frame = frame[rng.random(len(frame)) >= sparsity]
+    return frame.reset_index(drop=True)
+
+
+def sqlite_session(frame, url="sqlite:///:memory:"):
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.execute(insert(Sale), frame.to_dict("records"))
+    db.commit()
+    return db
@@ -4,4 +4,6 @@ python wait_for_db.py db 5432
 
 python migrations/init_db.py
 
+alembic upgrade head
+
 uvicorn main:app --host 0.0.0.0 --port 8000
\ No newline at end of file
@@ -0,0 +1,97 @@
+import csv
+import io
+import json
+import os
+import zlib
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal
+from models import Forecast, Sale
+
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "10000"))
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+# Колонки и порядок выгрузки; порядок совпадает с индексами таблиц
+EXPORT_TABLES = {
+    "sales": (
+        (Sale.item_id, Sale.sale_date, Sale.quantity),
+        (Sale.item_id, Sale.sale_date),
+    ),
+    "forecasts": (
+        (
+            Forecast.item_id,
+            Forecast.target_date,
+            Forecast.predicted_quantity,
+            Forecast.model_version,
+            Forecast.generated_at,
+        ),
+        (Forecast.item_id, Forecast.target_date),
+    ),
+}
+
+
+def _plain(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def encode_rows(rows, names, fmt):
+    if fmt == "ndjson":
+        return "".join(
+            json.dumps(dict(zip(names, map(_plain, row))), ensure_ascii=False)
+            + "\n"
+            for row in rows
+        )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerows([_plain(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+
+async def _export_rows(table, fmt, batch_size, session_factory):
+    columns, order = EXPORT_TABLES[table]
+    names = [column.key for column in columns]
+
+    # Заголовок уходит клиенту до запроса к БД
+    if fmt == "csv":
+        yield encode_rows([names], names, fmt).encode("utf-8")
+
+    async with session_factory() as db:
+        # Серверный курсор отдаёт строки пачками по batch_size,
+        # так что память не зависит от размера таблицы
+        result = await db.stream(
+            select(*columns)
+            .order_by(*order)
+            .execution_options(yield_per=batch_size)
+        )
+        async for rows in result.partitions():
+            yield encode_rows(rows, names, fmt).encode("utf-8")
+
+
+async def gzip_chunks(chunks):
+    # Z_SYNC_FLUSH после каждой пачки: клиент получает данные сразу,
+    # а не когда наберётся внутренний буфер zlib
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    async for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def export_stream(
+    table,
+    fmt,
+    compress=False,
+    batch_size=EXPORT_BATCH_SIZE,
+    session_factory=AsyncSessionLocal,
+):
+    # Проверка до начала ответа: внутри генератора ошибка пришла бы
+    # уже после отправленных заголовков
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Неизвестная таблица: {table}")
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise ValueError(f"Неподдерживаемый формат: {fmt}")
+    chunks = _export_rows(table, fmt, batch_size, session_factory)
+    return gzip_chunks(chunks) if compress else chunks
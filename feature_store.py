@@ -0,0 +1,213 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, func, insert, or_, select
+
+from models import FeatureStoreItem, Sale, SaleFeature
+
+
+USE_FEATURE_STORE = os.environ.get("FEATURE_STORE", "1") == "1"
+FEATURE_LAGS = [1, 3, 7, 14]
+CALENDAR_FEATURES = ["month_sin", "month_cos", "weekday_sin", "weekday_cos"]
+TAIL_SIZE = max(FEATURE_LAGS)
+
+_sync_lock = threading.Lock()
+
+
+def calendar_features(dates):
+    dates = pd.DatetimeIndex(dates)
+    # Те же формулы, что и в preprocess_item_data
+    month_rad = dates.month.to_numpy() * ((2 * np.pi) / 12)
+    weekday_rad = dates.weekday.to_numpy() * ((2 * np.pi) / 7)
+    return {
+        "month_sin": np.sin(month_rad),
+        "month_cos": np.cos(month_rad),
+        "weekday_sin": np.sin(weekday_rad),
+        "weekday_cos": np.cos(weekday_rad),
+    }
+
+
+def feature_rows(item_id, tail, rows):
+    # Новые строки получают лаги из сохранённого хвоста, поэтому
+    # стоимость зависит только от числа новых строк
+    history = list(tail)
+    calendar = calendar_features([sale_date for sale_date, _ in rows])
+    result = []
+    for position, (sale_date, quantity) in enumerate(rows):
+        row = {
+            "item_id": item_id,
+            "sale_date": sale_date,
+            "quantity": quantity,
+        }
+        for name in CALENDAR_FEATURES:
+            row[name] = float(calendar[name][position])
+        for lag in FEATURE_LAGS:
+            row[f"lag_{lag}"] = (
+                float(history[-lag]) if len(history) >= lag else None
+            )
+        history.append(quantity)
+        result.append(row)
+    return result, history[-TAIL_SIZE:]
+
+
+def _sales_stats(db_session, item_ids=None):
+    query = select(Sale.item_id, func.count(Sale.id), func.sum(Sale.quantity))
+    if item_ids is not None:
+        query = query.where(Sale.item_id.in_(item_ids))
+    rows = db_session.execute(query.group_by(Sale.item_id)).all()
+    return {item_id: (count, int(total)) for item_id, count, total in rows}
+
+
+def _grouped_sales(db_session, query):
+    grouped = {}
+    for item_id, sale_date, quantity in db_session.execute(query):
+        grouped.setdefault(item_id, []).append((sale_date, quantity))
+    return grouped
+
+
+def _drop_items(db_session, item_ids):
+    db_session.execute(
+        delete(SaleFeature).where(SaleFeature.item_id.in_(item_ids))
+    )
+    db_session.execute(
+        delete(FeatureStoreItem).where(FeatureStoreItem.item_id.in_(item_ids))
+    )
+
+
+def sync_features(db_session, item_ids=None):
+    with _sync_lock:
+        stats = _sales_stats(db_session, item_ids)
+        states_query = select(FeatureStoreItem)
+        if item_ids is not None:
+            states_query = states_query.where(
+                FeatureStoreItem.item_id.in_(item_ids)
+            )
+        states = {
+            state.item_id: state
+            for state in db_session.scalars(states_query)
+        }
+
+        # Одним запросом забираем только строки новее синхронизированных
+        new_rows_query = (
+            select(Sale.item_id, Sale.sale_date, Sale.quantity)
+            .outerjoin(
+                FeatureStoreItem, FeatureStoreItem.item_id == Sale.item_id
+            )
+            .where(
+                or_(
+                    FeatureStoreItem.last_date.is_(None),
+                    Sale.sale_date > FeatureStoreItem.last_date,
+                )
+            )
+            .order_by(Sale.item_id, Sale.sale_date)
+        )
+        if item_ids is not None:
+            new_rows_query = new_rows_query.where(Sale.item_id.in_(item_ids))
+        new_rows = _grouped_sales(db_session, new_rows_query)
+
+        appended, rebuild = {}, []
+        for item_id, (count, total) in stats.items():
+            state = states.get(item_id)
+            rows = new_rows.get(item_id, [])
+            base_count = state.row_count if state else 0
+            base_total = state.quantity_total if state else 0
+            added_total = sum(quantity for _, quantity in rows)
+            if (base_count + len(rows), base_total + added_total) == (
+                count,
+                total,
+            ):
+                if rows:
+                    appended[item_id] = rows
+            else:
+                # Задним числом вставленные или изменённые продажи
+                # ломают хвост, такой товар пересчитывается целиком
+                rebuild.append(item_id)
+
+        orphaned = sorted(set(states) - set(stats))
+        if rebuild or orphaned:
+            _drop_items(db_session, rebuild + orphaned)
+        if rebuild:
+            appended.update(
+                _grouped_sales(
+                    db_session,
+                    select(Sale.item_id, Sale.sale_date, Sale.quantity)
+                    .where(Sale.item_id.in_(rebuild))
+                    .order_by(Sale.item_id, Sale.sale_date),
+                )
+            )
+
+        feature_batch = []
+        for item_id, rows in appended.items():
+            state = None if item_id in rebuild else states.get(item_id)
+            tail = json.loads(state.tail) if state else []
+            item_features, tail = feature_rows(item_id, tail, rows)
+            feature_batch.extend(item_features)
+            if state is None:
+                state = FeatureStoreItem(
+                    item_id=item_id, row_count=0, quantity_total=0
+                )
+                db_session.add(state)
+            state.last_date = rows[-1][0]
+            state.row_count += len(rows)
+            state.quantity_total += sum(quantity for _, quantity in rows)
+            state.tail = json.dumps(tail)
+
+        if feature_batch:
+            db_session.execute(insert(SaleFeature), feature_batch)
+        db_session.commit()
+        return {
+            "appended": sum(
+                len(rows)
+                for item_id, rows in appended.items()
+                if item_id not in rebuild
+            ),
+            "rebuilt": sorted(rebuild),
+        }
+
+
+def rebuild_features(db_session, item_ids=None):
+    with _sync_lock:
+        if item_ids is None:
+            db_session.execute(delete(SaleFeature))
+            db_session.execute(delete(FeatureStoreItem))
+        else:
+            _drop_items(db_session, list(item_ids))
+        db_session.commit()
+    return sync_features(db_session, item_ids)
+
+
+def item_training_data(db_session, item_id, lookback_rows=None):
+    columns = [
+        SaleFeature.quantity,
+        *(getattr(SaleFeature, name) for name in CALENDAR_FEATURES),
+        *(getattr(SaleFeature, f"lag_{lag}") for lag in FEATURE_LAGS),
+    ]
+    query = (
+        select(*columns)
+        .where(SaleFeature.item_id == item_id)
+        .order_by(SaleFeature.sale_date.desc())
+    )
+    if lookback_rows:
+        query = query.limit(lookback_rows)
+    rows = db_session.execute(query).all()[::-1]
+    data = pd.DataFrame(
+        rows, columns=[column.key for column in columns], dtype="float64"
+    )
+
+    # Набор лагов и отброшенные строки совпадают с preprocess_item_data
+    n_samples = len(data)
+    lags = [lag for lag in FEATURE_LAGS if n_samples >= lag + 1]
+    feature_columns = CALENDAR_FEATURES + [f"lag_{lag}" for lag in lags]
+    data = data.iloc[max(lags, default=0) :]
+    return data[feature_columns], data["quantity"], feature_columns
+
+
+def feature_loader(db_session, item_id, lookback_rows=None):
+    def load():
+        sync_features(db_session, [item_id])
+        return item_training_data(db_session, item_id, lookback_rows)
+
+    return load
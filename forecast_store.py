@@ -0,0 +1,83 @@
+import os
+from datetime import date, datetime, timezone
+from itertools import groupby
+
+from sqlalchemy import delete, func, insert, select
+
+from models import Forecast
+
+
+# Сколько дней прогноза хранится; это же предел days в /api/forecast
+FORECAST_STORED_DAYS = int(os.environ.get("FORECAST_STORED_DAYS", "365"))
+
+
+def stored_versions(db_session, item_ids=None):
+    query = select(Forecast.item_id, func.max(Forecast.model_version))
+    if item_ids is not None:
+        query = query.where(Forecast.item_id.in_(item_ids))
+    rows = db_session.execute(query.group_by(Forecast.item_id)).all()
+    return {item_id: version for item_id, version in rows}
+
+
+def stale_items(expected, versions):
+    # expected: {item_id: актуальная версия прогноза}. Устаревшие товары
+    # пересчитываются, а товары без продаж удаляются
+    stale = sorted(
+        item_id
+        for item_id, version in expected.items()
+        if versions.get(item_id) != version
+    )
+    removed = sorted(set(versions) - set(expected))
+    return stale, removed
+
+
+def read_forecasts(db_session, item_ids=None, forecast_days=None):
+    query = select(
+        Forecast.item_id, Forecast.target_date, Forecast.predicted_quantity
+    )
+    if item_ids is not None:
+        query = query.where(Forecast.item_id.in_(item_ids))
+    rows = db_session.execute(
+        query.order_by(Forecast.item_id, Forecast.target_date)
+    ).all()
+
+    forecast_list = []
+    for item_id, item_rows in groupby(rows, key=lambda row: row.item_id):
+        item_rows = list(item_rows)
+        if forecast_days is not None:
+            item_rows = item_rows[:forecast_days]
+        forecast_list.extend(
+            {
+                "date": row.target_date.isoformat(),
+                "predicted_quantity": row.predicted_quantity,
+                "item_id": item_id,
+            }
+            for row in item_rows
+        )
+    return forecast_list
+
+
+def write_forecasts(db_session, versions, forecasts):
+    # versions: {item_id: версия прогноза}, None удаляет прогноз товара.
+    # Старые строки заменяются целиком в одной транзакции
+    if not versions:
+        return 0
+    generated_at = datetime.now(timezone.utc)
+    rows = [
+        {
+            "item_id": forecast["item_id"],
+            "target_date": date.fromisoformat(forecast["date"]),
+            "predicted_quantity": forecast["predicted_quantity"],
+            "model_version": versions[forecast["item_id"]],
+            "generated_at": generated_at,
+        }
+        for forecast in forecasts
+        if versions.get(forecast["item_id"]) is not None
+    ]
+    db_session.execute(
+        delete(Forecast).where(Forecast.item_id.in_(list(versions)))
+    )
+    if rows:
+        db_session.execute(insert(Forecast), rows)
+    db_session.commit()
+    return len(rows)
@@ -1,16 +1,80 @@
 import pandas as pd
 from datetime import datetime, timedelta
 import numpy as np
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras import layers
+from sqlalchemy import func, select
 from models import Sale
+from forecast_store import (
+    FORECAST_STORED_DAYS,
+    stale_items,
+    stored_versions,
+    write_forecasts,
+)
+from feature_store import USE_FEATURE_STORE, feature_loader
+from snapshots import (
+    SNAPSHOT_DIR,
+    USE_SALES_SNAPSHOT,
+    load_snapshot,
+    load_snapshot_frame,
+)
+from metrics import count, timed
+from singleflight import SingleFlight
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+import hashlib
+import json
+import multiprocessing
 import os
+import pickle
+import threading
+import time
+import uuid
 
 
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "2"
 
+MODEL_REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR", "model_registry")
+FORECAST_DAYS = 20
+FORECAST_WORKERS = int(os.environ.get("FORECAST_WORKERS", "1"))
+TF_THREADS_PER_WORKER = int(os.environ.get("TF_THREADS_PER_WORKER", "1"))
+FORECAST_MODEL_MODE = os.environ.get("FORECAST_MODEL_MODE", "per_item")
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "numpy")
+SALES_CHUNK_SIZE = int(os.environ.get("SALES_CHUNK_SIZE", "50000"))
+TRAINING_LOOKBACK_ROWS = int(os.environ.get("TRAINING_LOOKBACK_ROWS", "0"))
 
+# Бюджет обучения одной модели: потолок эпох, ранняя остановка по
+# валидации на последних строках, лимит времени и окно истории
+TRAINING_BUDGET = {
+    "epochs": int(os.environ.get("TRAINING_EPOCHS", "50")),
+    "patience": int(os.environ.get("TRAINING_PATIENCE", "5")),
+    "validation_split": float(
+        os.environ.get("TRAINING_VALIDATION_SPLIT", "0.2")
+    ),
+    "max_seconds": float(os.environ.get("TRAINING_MAX_SECONDS", "30")),
+    "max_rows": int(os.environ.get("TRAINING_MAX_ROWS", "1000")),
+}
+MIN_VALIDATION_ROWS = 3
+
+# Дообучение прошлой модели товара вместо обучения с нуля
+WARM_START = os.environ.get("WARM_START", "1") == "1"
+FINETUNE_EPOCHS = int(os.environ.get("FINETUNE_EPOCHS", "5"))
+FINETUNE_ROWS = int(os.environ.get("FINETUNE_ROWS", "90"))
+FINETUNE_LEARNING_RATE = 0.0005
+FULL_RETRAIN_DAYS = float(os.environ.get("FULL_RETRAIN_DAYS", "7"))
+# Сдвиг среднего лагов в свежем окне, в стандартных отклонениях
+DRIFT_THRESHOLD = float(os.environ.get("DRIFT_THRESHOLD", "1.0"))
+
+GLOBAL_LAGS = [1, 3, 7, 14]
+GLOBAL_FEATURES = [
+    "month_sin",
+    "month_cos",
+    "weekday_sin",
+    "weekday_cos",
+] + [f"lag_{lag}" for lag in GLOBAL_LAGS]
+GLOBAL_EMBEDDING_DIM = 8
+
+
+@timed("preprocess")
 def preprocess_item_data(data):
     if data["sale_date"].dtype != "datetime64[ns]":
         data["sale_date"] = pd.to_datetime(data["sale_date"])
@@ -46,7 +110,7 @@ def preprocess_item_data(data):
             lag_features.append(lag_col)
             max_lag = max(max_lag, lag)
         else:
-            print(f"Недостаточно данных для лаг {lag}")
+            count("lag_skipped")
 
     if lag_features:
         data = data.iloc[max_lag:].copy()
@@ -56,125 +120,1403 @@ def preprocess_item_data(data):
     X = data[feature_columns]
     y = data["quantity"]
 
-    print("Размер X:", X.shape)
-    print("Размер y:", y.shape)
-    print("Используемые признаки:", feature_columns)
-
+    count("preprocessed_rows", len(X))
     return X, y, feature_columns
 
 
-def forecast_item_sales(
-    model, scaler, last_known_data, forecast_days, feature_columns
-):
-    last_date = last_known_data["sale_date"].max()
-    future_dates = [
-        last_date + timedelta(days=i) for i in range(1, forecast_days + 1)
-    ]
-    future_data = pd.DataFrame({"sale_date": future_dates})
+def _future_calendar(last_dates, forecast_days):
+    last_dates = np.asarray(last_dates, dtype="datetime64[D]")
+    offsets = np.arange(1, forecast_days + 1)
+    dates = (last_dates[:, None] + offsets[None, :]).ravel()
+    months = dates.astype("datetime64[M]").astype(int) % 12 + 1
+    # 1970-01-01 был четвергом, а в pandas понедельник равен нулю
+    weekdays = (dates.astype(int) + 3) % 7
+    return dates, months, weekdays
 
-    future_data["month_sin"] = np.sin(
-        2 * np.pi * future_data["sale_date"].dt.month / 12
-    )
-    future_data["month_cos"] = np.cos(
-        2 * np.pi * future_data["sale_date"].dt.month / 12
-    )
-    future_data["weekday_sin"] = np.sin(
-        2 * np.pi * future_data["sale_date"].dt.weekday / 7
-    )
-    future_data["weekday_cos"] = np.cos(
-        2 * np.pi * future_data["sale_date"].dt.weekday / 7
+
+def _adjust_predictions(predictions, months):
+    adjusted = predictions.astype(float)
+    adjusted = np.where(np.isin(months, [6, 7, 8]), adjusted * 1.3, adjusted)
+    adjusted = np.where(np.isin(months, [12, 1, 2]), adjusted * 0.9, adjusted)
+    return np.maximum(np.round(adjusted, 2), 0)
+
+
+def _item_future_features(item_frames, items, feature_columns, forecast_days):
+    last_dates = np.array(
+        [item_frames[item]["sale_date"].to_numpy().max() for item in items],
+        dtype="datetime64[D]",
     )
+    dates, months, weekdays = _future_calendar(last_dates, forecast_days)
+    quantities = [item_frames[item]["quantity"].to_numpy() for item in items]
 
+    calendar = {
+        "month_sin": np.sin(2 * np.pi * months / 12),
+        "month_cos": np.cos(2 * np.pi * months / 12),
+        "weekday_sin": np.sin(2 * np.pi * weekdays / 7),
+        "weekday_cos": np.cos(2 * np.pi * weekdays / 7),
+    }
+    columns = []
     for col in feature_columns:
         if col.startswith("lag_"):
+            # Лаг фиксируется на последнем известном значении на весь горизонт
             lag = int(col.split("_")[1])
-            if len(last_known_data) >= lag:
-                lag_value = last_known_data["quantity"].iloc[-lag]
-                future_data[col] = lag_value
-            else:
-                future_data[col] = 0
-
-    X_future = future_data[feature_columns]
-    X_future_scaled = scaler.transform(X_future)
-    predictions = model.predict(X_future_scaled).flatten()
-
-    adjusted_predictions = []
-    for date, pred in zip(future_data["sale_date"], predictions):
-        adjusted_pred = float(pred)
-        month = date.month
-        if month in [6, 7, 8]:
-            adjusted_pred *= 1.3
-        elif month in [12, 1, 2]:
-            adjusted_pred *= 0.9
-        adjusted_predictions.append(max(round(adjusted_pred, 2), 0))
+            values = np.array(
+                [q[-lag] if len(q) >= lag else 0 for q in quantities],
+                dtype="float64",
+            )
+            columns.append(np.repeat(values, forecast_days))
+        else:
+            columns.append(calendar[col])
+
+    return np.column_stack(columns), dates, months
+
+
+def _as_numpy_model(model):
+    if isinstance(model, NumpyDenseModel):
+        return model
+    if hasattr(model, "layers") and is_dense_stack(model):
+        return NumpyDenseModel.from_keras(model)
+    return None
+
+
+def _predict_stacked(models, X, forecast_days):
+    # Одинаковые по архитектуре сети считаются одним einsum на слой
+    hidden = X.reshape(len(models), forecast_days, -1).astype("float32")
+    for layer, activation in enumerate(models[0].activations):
+        kernel = np.stack([model.kernels[layer] for model in models])
+        bias = np.stack([model.biases[layer] for model in models])
+        hidden = np.einsum("nhi,nio->nho", hidden, kernel) + bias[:, None]
+        if activation == "relu":
+            np.maximum(hidden, 0, out=hidden)
+    return hidden.reshape(-1)
+
+
+@timed("predict")
+def forecast_items_batched(entries, item_frames, forecast_days=FORECAST_DAYS):
+    groups = {}
+    for item, (model, scaler, feature_columns) in entries.items():
+        numpy_model = _as_numpy_model(model)
+        if numpy_model is None:
+            key = ("model", id(model), tuple(feature_columns))
+        else:
+            key = (
+                "numpy",
+                tuple(feature_columns),
+                tuple(kernel.shape for kernel in numpy_model.kernels),
+                tuple(numpy_model.activations),
+            )
+        groups.setdefault(key, []).append(
+            (item, numpy_model or model, scaler)
+        )
+
+    predictions = {}
+    for key, members in groups.items():
+        items = [item for item, _, _ in members]
+        feature_columns = entries[items[0]][2]
+        X, dates, months = _item_future_features(
+            item_frames, items, feature_columns, forecast_days
+        )
+        means = np.repeat(
+            np.stack([np.asarray(s.mean_) for _, _, s in members]),
+            forecast_days,
+            axis=0,
+        )
+        scales = np.repeat(
+            np.stack([np.asarray(s.scale_) for _, _, s in members]),
+            forecast_days,
+            axis=0,
+        )
+        X_scaled = (X - means) / scales
+
+        if key[0] == "numpy":
+            values = _predict_stacked(
+                [model for _, model, _ in members], X_scaled, forecast_days
+            )
+        else:
+            values = (
+                members[0][1].predict(X_scaled, verbose=0).reshape(-1)
+            )
+
+        adjusted = _adjust_predictions(values, months)
+        date_strings = np.datetime_as_string(dates, unit="D")
+        for position, item in enumerate(items):
+            window = slice(
+                position * forecast_days, (position + 1) * forecast_days
+            )
+            predictions[item] = (date_strings[window], adjusted[window])
 
     forecast_list = []
-    for date, pred in zip(future_data["sale_date"], adjusted_predictions):
-        forecast_list.append(
-            {"date": date.strftime("%Y-%m-%d"), "predicted_quantity": pred}
+    for item in entries:
+        date_strings, values = predictions[item]
+        forecast_list.extend(
+            {
+                "date": str(date),
+                "predicted_quantity": float(value),
+                "item_id": item,
+            }
+            for date, value in zip(date_strings, values)
         )
+    return forecast_list
 
-    print(type(pred))
 
+def forecast_item_sales(
+    model, scaler, last_known_data, forecast_days, feature_columns
+):
+    forecast_list = forecast_items_batched(
+        {None: (model, scaler, feature_columns)},
+        {None: last_known_data},
+        forecast_days,
+    )
+    for forecast in forecast_list:
+        del forecast["item_id"]
     return forecast_list
 
 
-def train_item_model(X, y):
-    from sklearn.preprocessing import StandardScaler
+ITEM_LAYER_SIZES = [64, 32, 1]
+
+
+def build_item_model(input_dim):
     from tensorflow.keras.models import Sequential
     from tensorflow.keras.layers import Dense, Input
 
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
-
-    input_dim = X_scaled.shape[1]
     model = Sequential()
     model.add(Input(shape=(input_dim,)))
-    model.add(Dense(64, activation="relu"))
-    model.add(Dense(32, activation="relu"))
-    model.add(Dense(1))
+    model.add(Dense(ITEM_LAYER_SIZES[0], activation="relu"))
+    model.add(Dense(ITEM_LAYER_SIZES[1], activation="relu"))
+    model.add(Dense(ITEM_LAYER_SIZES[2]))
+    return model
+
+
+def training_budget(budget=None):
+    return {**TRAINING_BUDGET, **(budget or {})}
+
+
+def validation_rows(n_rows, budget):
+    # Без early stopping или на коротком ряду валидация не выделяется
+    if not budget["patience"]:
+        return 0
+    rows = int(n_rows * budget["validation_split"])
+    if rows < MIN_VALIDATION_ROWS or n_rows - rows < 1:
+        return 0
+    return rows
+
+
+def _time_limit_callback(max_seconds):
+    from tensorflow import keras
+
+    class TimeLimit(keras.callbacks.Callback):
+        def on_train_begin(self, logs=None):
+            self.started = time.monotonic()
+            self.reached = False
+
+        def on_epoch_end(self, epoch, logs=None):
+            if time.monotonic() - self.started >= max_seconds:
+                self.reached = True
+                self.model.stop_training = True
+
+    return TimeLimit()
+
 
+@timed("train")
+def train_item_model(X, y, seed=None, budget=None, report=None):
+    from sklearn.preprocessing import StandardScaler
+    from tensorflow import keras
+
+    if seed is not None:
+        keras.utils.set_random_seed(seed)
+
+    started = time.monotonic()
+    budget = training_budget(budget)
+    if budget["max_rows"]:
+        X, y = X.iloc[-budget["max_rows"] :], y.iloc[-budget["max_rows"] :]
+
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
+    y = np.asarray(y, dtype="float32")
+
+    model = build_item_model(X_scaled.shape[1])
     model.compile(optimizer="adam", loss="mean_squared_error")
 
-    model.fit(X_scaled, y, epochs=50, verbose=0)
+    callbacks, fit_options = [], {}
+    val_rows = validation_rows(len(X_scaled), budget)
+    if val_rows:
+        # Валидация на самых свежих строках, как и прогноз
+        early_stopping = keras.callbacks.EarlyStopping(
+            patience=budget["patience"], restore_best_weights=True
+        )
+        callbacks.append(early_stopping)
+        fit_options["validation_data"] = (
+            X_scaled[-val_rows:],
+            y[-val_rows:],
+        )
+        X_train, y_train = X_scaled[:-val_rows], y[:-val_rows]
+    else:
+        early_stopping = None
+        X_train, y_train = X_scaled, y
+    time_limit = None
+    if budget["max_seconds"]:
+        time_limit = _time_limit_callback(budget["max_seconds"])
+        callbacks.append(time_limit)
+
+    history = model.fit(
+        X_train,
+        y_train,
+        epochs=budget["epochs"],
+        callbacks=callbacks,
+        verbose=0,
+        **fit_options,
+    )
+
+    if report is not None:
+        if early_stopping is not None and early_stopping.stopped_epoch:
+            stop_reason = "early_stopping"
+        elif time_limit is not None and time_limit.reached:
+            stop_reason = "time_limit"
+        else:
+            stop_reason = "max_epochs"
+        report.update(
+            epochs=len(history.history["loss"]),
+            seconds=round(time.monotonic() - started, 3),
+            rows=len(X_train),
+            validation_rows=val_rows,
+            stop_reason=stop_reason,
+        )
 
     return model, scaler
 
 
-def forecast_with_dynamic_features(db_session):
-    sales = db_session.query(Sale).all()
-    if not sales:
-        return []
+def detect_drift(scaler, X_recent):
+    # Лаги — это прошлые продажи, так что их сдвиг относительно
+    # статистики скейлера показывает, что ряд ушёл от обучающих данных
+    lag_positions = [
+        position
+        for position, column in enumerate(X_recent.columns)
+        if column.startswith("lag_")
+    ]
+    if not lag_positions or len(X_recent) == 0:
+        return False
+    scaled = scaler.transform(X_recent)[:, lag_positions]
+    return bool(np.abs(scaled.mean(axis=0)).max() > DRIFT_THRESHOLD)
+
+
+@timed("fine_tune")
+def fine_tune_item_model(
+    model, scaler, X, y, seed=None, budget=None, report=None
+):
+    from tensorflow import keras
+
+    if seed is not None:
+        keras.utils.set_random_seed(seed)
+
+    started = time.monotonic()
+    budget = training_budget(budget)
+    # Скейлер прежний: веса сети обучены под его масштаб
+    X_recent = scaler.transform(X.iloc[-FINETUNE_ROWS:])
+    y_recent = np.asarray(y.iloc[-FINETUNE_ROWS:], dtype="float32")
+
+    model.compile(
+        optimizer=keras.optimizers.Adam(learning_rate=FINETUNE_LEARNING_RATE),
+        loss="mean_squared_error",
+    )
+    callbacks = []
+    if budget["max_seconds"]:
+        callbacks.append(_time_limit_callback(budget["max_seconds"]))
+    history = model.fit(
+        X_recent,
+        y_recent,
+        epochs=FINETUNE_EPOCHS,
+        callbacks=callbacks,
+        verbose=0,
+    )
+
+    if report is not None:
+        report.update(
+            epochs=len(history.history["loss"]),
+            seconds=round(time.monotonic() - started, 3),
+            rows=len(X_recent),
+            validation_rows=0,
+            stop_reason="max_epochs",
+        )
+    return model, scaler
+
+
+def _train_stacked_group(X_scaled, y, budget, batch_size, rng):
+    import tensorflow as tf
+
+    started = time.monotonic()
+    # X_scaled: список матриц (rows_i, d) с одинаковым набором признаков
+    n_items = len(X_scaled)
+    input_dim = X_scaled[0].shape[1]
+    max_rows = max(len(x) for x in X_scaled)
+
+    X_padded = np.zeros((n_items, max_rows, input_dim), dtype="float32")
+    y_padded = np.zeros((n_items, max_rows), dtype="float32")
+    mask = np.zeros((n_items, max_rows), dtype="float32")
+    val_mask = np.zeros((n_items, max_rows), dtype="float32")
+    val_rows = np.array([validation_rows(len(x), budget) for x in X_scaled])
+    for index, (x, target) in enumerate(zip(X_scaled, y)):
+        train_rows = len(x) - val_rows[index]
+        X_padded[index, : len(x)] = x
+        y_padded[index, : len(x)] = target
+        mask[index, :train_rows] = 1.0
+        val_mask[index, train_rows : len(x)] = 1.0
+
+    # Веса всех сетей товара сложены по первой оси; инициализация
+    # как у Dense в Keras: glorot_uniform для ядер и нули для смещений
+    sizes = [input_dim] + ITEM_LAYER_SIZES
+    params = []
+    for fan_in, fan_out in zip(sizes[:-1], sizes[1:]):
+        limit = np.sqrt(6 / (fan_in + fan_out))
+        kernel = rng.uniform(-limit, limit, (n_items, fan_in, fan_out))
+        params.append(tf.Variable(kernel.astype("float32")))
+        params.append(tf.Variable(np.zeros((n_items, fan_out), "float32")))
+
+    # Adam считается вручную, чтобы шаг для товара делался только на
+    # батчах, где у него есть строки, как при отдельном обучении
+    first_moments = [tf.Variable(tf.zeros_like(p)) for p in params]
+    second_moments = [tf.Variable(tf.zeros_like(p)) for p in params]
+    steps = tf.Variable(tf.zeros((n_items,)))
+    learning_rate, beta_1, beta_2, epsilon = 0.001, 0.9, 0.999, 1e-7
+
+    def forward(x):
+        hidden = x
+        for layer in range(len(ITEM_LAYER_SIZES)):
+            kernel, bias = params[2 * layer], params[2 * layer + 1]
+            hidden = tf.einsum("nbi,nio->nbo", hidden, kernel)
+            hidden = hidden + bias[:, None, :]
+            if layer < len(ITEM_LAYER_SIZES) - 1:
+                hidden = tf.nn.relu(hidden)
+        return hidden[..., 0]
+
+    @tf.function
+    def train_step(x, target, batch_mask):
+        rows = tf.reduce_sum(batch_mask, axis=1)
+        active = tf.cast(rows > 0, tf.float32)
+        with tf.GradientTape() as tape:
+            errors = tf.square(forward(x) - target) * batch_mask
+            loss = tf.reduce_sum(
+                tf.reduce_sum(errors, axis=1) / tf.maximum(rows, 1.0)
+            )
+        gradients = tape.gradient(loss, params)
+
+        steps.assign_add(active)
+        t = tf.maximum(steps, 1.0)
+        alpha = learning_rate * tf.sqrt(1 - beta_2**t) / (1 - beta_1**t)
+        for param, grad, m, v in zip(
+            params, gradients, first_moments, second_moments
+        ):
+            shape = [-1] + [1] * (len(param.shape) - 1)
+            item_active = tf.reshape(active, shape)
+            m.assign(
+                item_active * (beta_1 * m + (1 - beta_1) * grad)
+                + (1 - item_active) * m
+            )
+            v.assign(
+                item_active * (beta_2 * v + (1 - beta_2) * tf.square(grad))
+                + (1 - item_active) * v
+            )
+            param.assign_sub(
+                item_active
+                * tf.reshape(alpha, shape)
+                * m
+                / (tf.sqrt(v) + epsilon)
+            )
+
+    # Ранняя остановка по товарам: остановленный товар выпадает из
+    # маски и дальше не обновляется, как отдельная модель в Keras
+    has_validation = val_rows > 0
+    stopped = np.zeros(n_items, dtype=bool)
+    early_stopped = np.zeros(n_items, dtype=bool)
+    epochs_run = np.zeros(n_items, dtype=int)
+    best_loss = np.full(n_items, np.inf)
+    wait = np.zeros(n_items, dtype=int)
+    best_weights = [p.numpy() for p in params]
+    time_limited = False
+
+    for epoch in range(budget["epochs"]):
+        active = ~stopped
+        epoch_mask = mask * active[:, None]
+        # Строки каждого товара перемешиваются независимо, паддинг в конце
+        order = np.argsort(
+            rng.random(mask.shape) + (1 - epoch_mask) * 2, axis=1
+        )
+        X_epoch = np.take_along_axis(X_padded, order[..., None], axis=1)
+        y_epoch = np.take_along_axis(y_padded, order, axis=1)
+        mask_epoch = np.take_along_axis(epoch_mask, order, axis=1)
+        for start in range(0, max_rows, batch_size):
+            stop = start + batch_size
+            train_step(
+                tf.constant(X_epoch[:, start:stop]),
+                tf.constant(y_epoch[:, start:stop]),
+                tf.constant(mask_epoch[:, start:stop]),
+            )
+        epochs_run[active] += 1
+
+        if has_validation.any():
+            errors = (forward(tf.constant(X_padded)).numpy() - y_padded) ** 2
+            val_loss = (errors * val_mask).sum(axis=1) / np.maximum(
+                val_mask.sum(axis=1), 1
+            )
+            checked = has_validation & active
+            improved = checked & (val_loss < best_loss)
+            if improved.any():
+                for best, param in zip(best_weights, params):
+                    best[improved] = param.numpy()[improved]
+                best_loss[improved] = val_loss[improved]
+            wait[improved] = 0
+            wait[checked & ~improved] += 1
+            newly_stopped = checked & (wait >= budget["patience"])
+            if epoch > 0:
+                early_stopped |= newly_stopped
+                stopped |= newly_stopped
+
+        if stopped.all():
+            break
+        if (
+            budget["max_seconds"]
+            and time.monotonic() - started >= budget["max_seconds"]
+        ):
+            time_limited = True
+            break
+
+    weights = [p.numpy() for p in params]
+    for weight, best in zip(weights, best_weights):
+        weight[has_validation] = best[has_validation]
+
+    seconds = round(time.monotonic() - started, 3)
+    reports = []
+    for index in range(n_items):
+        if early_stopped[index]:
+            stop_reason = "early_stopping"
+        elif time_limited:
+            stop_reason = "time_limit"
+        else:
+            stop_reason = "max_epochs"
+        reports.append(
+            {
+                "epochs": int(epochs_run[index]),
+                # Товары группы обучаются одновременно и делят время
+                "seconds": seconds,
+                "rows": int(mask[index].sum()),
+                "validation_rows": int(val_rows[index]),
+                "stop_reason": stop_reason,
+            }
+        )
+    return weights, reports
+
+
+@timed("train_batched")
+def train_item_models_batched(
+    datasets, batch_size=32, seed=None, budget=None, reports=None
+):
+    from sklearn.preprocessing import StandardScaler
+
+    rng = np.random.default_rng(seed)
+    budget = training_budget(budget)
+    results = [None] * len(datasets)
+    if budget["max_rows"]:
+        datasets = [
+            (X.iloc[-budget["max_rows"] :], y.iloc[-budget["max_rows"] :])
+            for X, y in datasets
+        ]
+    if reports is not None:
+        reports[:] = [None] * len(datasets)
+
+    groups = {}
+    for index, (X, y) in enumerate(datasets):
+        groups.setdefault(tuple(X.columns), []).append(index)
+
+    for indices in groups.values():
+        scalers = [StandardScaler() for _ in indices]
+        X_scaled = [
+            scaler.fit_transform(datasets[index][0])
+            for scaler, index in zip(scalers, indices)
+        ]
+        y = [np.asarray(datasets[index][1], "float32") for index in indices]
+        weights, group_reports = _train_stacked_group(
+            X_scaled, y, budget, batch_size, rng
+        )
+
+        # Веса остаются массивами NumPy: сеть Keras собирается из них
+        # только для дообучения или по запросу бэкенда keras
+        activations = ["relu"] * (len(ITEM_LAYER_SIZES) - 1) + ["linear"]
+        for position, (index, scaler) in enumerate(zip(indices, scalers)):
+            model = NumpyDenseModel(
+                [w[position] for w in weights[0::2]],
+                [w[position] for w in weights[1::2]],
+                activations,
+            )
+            results[index] = (model, scaler)
+            if reports is not None:
+                reports[index] = group_reports[position]
+
+    return results
+
+
+def preprocess_global_data(data):
+    data = data.sort_values(["item_id", "sale_date"], kind="stable").copy()
+    data["sale_date"] = pd.to_datetime(data["sale_date"])
+
+    month_rad = data["sale_date"].dt.month * (2 * np.pi / 12)
+    weekday_rad = data["sale_date"].dt.weekday * (2 * np.pi / 7)
+    data["month_sin"] = np.sin(month_rad)
+    data["month_cos"] = np.cos(month_rad)
+    data["weekday_sin"] = np.sin(weekday_rad)
+    data["weekday_cos"] = np.cos(weekday_rad)
+
+    quantity = data.groupby("item_id")["quantity"]
+    for lag in GLOBAL_LAGS:
+        data[f"lag_{lag}"] = quantity.shift(lag)
+
+    # Короткие ряды не отбрасываются целиком: недостающие лаги равны нулю
+    data = data[data["lag_1"].notna()]
+    X = data[GLOBAL_FEATURES].fillna(0)
+
+    return X, data["item_id"], data["quantity"]
+
+
+@timed("train_global")
+def train_global_model(X, item_index, y, n_items, seed=None, budget=None):
+    from sklearn.preprocessing import StandardScaler
+    from tensorflow import keras
+    from tensorflow.keras import layers
+
+    if seed is not None:
+        keras.utils.set_random_seed(seed)
+    budget = training_budget(budget)
+
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
+
+    features_input = keras.Input(shape=(X_scaled.shape[1],))
+    item_input = keras.Input(shape=(1,), dtype="int32")
+    item_embedding = layers.Flatten()(
+        layers.Embedding(n_items, GLOBAL_EMBEDDING_DIM)(item_input)
+    )
+    hidden = layers.Concatenate()([features_input, item_embedding])
+    hidden = layers.Dense(64, activation="relu")(hidden)
+    hidden = layers.Dense(32, activation="relu")(hidden)
+    output = layers.Dense(1)(hidden)
+
+    model = keras.Model(inputs=[features_input, item_input], outputs=output)
+    model.compile(optimizer="adam", loss="mean_squared_error")
+    callbacks = []
+    if budget["max_seconds"]:
+        callbacks.append(_time_limit_callback(budget["max_seconds"]))
+    model.fit(
+        [X_scaled, np.asarray(item_index)],
+        np.asarray(y, dtype="float32"),
+        epochs=budget["epochs"],
+        batch_size=256,
+        callbacks=callbacks,
+        verbose=0,
+    )
+
+    return model, scaler
+
+
+@timed("predict_global")
+def forecast_global(model, scaler, item_ids, data, forecast_days):
+    data = data.sort_values(["item_id", "sale_date"], kind="stable")
+    quantity = data.groupby("item_id")["quantity"]
+    item_ids = np.asarray(item_ids)
+
+    last_dates = (
+        pd.to_datetime(data.groupby("item_id")["sale_date"].max())
+        .reindex(item_ids)
+        .to_numpy()
+    )
+    dates, months, weekdays = _future_calendar(last_dates, forecast_days)
+
+    features = {
+        "month_sin": np.sin(2 * np.pi * months / 12),
+        "month_cos": np.cos(2 * np.pi * months / 12),
+        "weekday_sin": np.sin(2 * np.pi * weekdays / 7),
+        "weekday_cos": np.cos(2 * np.pi * weekdays / 7),
+    }
+    for lag in GLOBAL_LAGS:
+        # Как и в forecast_item_sales, лаг фиксируется на последнем
+        # известном значении на весь горизонт
+        lag_values = quantity.nth(-lag)
+        lag_values.index = data.loc[lag_values.index, "item_id"]
+        lag_values = lag_values.reindex(item_ids).fillna(0).to_numpy()
+        features[f"lag_{lag}"] = np.repeat(lag_values, forecast_days)
+
+    X_future = pd.DataFrame(features)[GLOBAL_FEATURES]
+    item_index = np.repeat(np.arange(len(item_ids)), forecast_days)
+    predictions = model.predict(
+        [scaler.transform(X_future), item_index],
+        batch_size=max(len(item_index), 1),
+        verbose=0,
+    ).flatten()
+
+    adjusted = _adjust_predictions(predictions, months)
+    date_strings = np.datetime_as_string(dates, unit="D")
+    item_column = np.repeat(item_ids, forecast_days)
+
+    return [
+        {
+            "date": str(date),
+            "predicted_quantity": float(pred),
+            "item_id": int(item),
+        }
+        for date, pred, item in zip(date_strings, adjusted, item_column)
+    ]
+
+
+def global_fingerprint(fingerprints):
+    payload = json.dumps(sorted(fingerprints.items()), default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class NumpyDenseModel:
+    def __init__(self, kernels, biases, activations):
+        self.kernels = kernels
+        self.biases = biases
+        self.activations = activations
+
+    @classmethod
+    def from_keras(cls, model):
+        dense_layers = [layer for layer in model.layers if layer.weights]
+        kernels, biases, activations = [], [], []
+        for layer in dense_layers:
+            kernel, bias = layer.get_weights()
+            kernels.append(kernel.astype("float32"))
+            biases.append(bias.astype("float32"))
+            activations.append(layer.get_config()["activation"])
+        return cls(kernels, biases, activations)
+
+    def to_keras(self):
+        from tensorflow.keras.models import Sequential
+        from tensorflow.keras.layers import Dense, Input
+
+        model = Sequential()
+        model.add(Input(shape=(self.kernels[0].shape[0],)))
+        for kernel, activation in zip(self.kernels, self.activations):
+            model.add(Dense(kernel.shape[1], activation=activation))
+        model.set_weights(
+            [w for pair in zip(self.kernels, self.biases) for w in pair]
+        )
+        return model
+
+    def predict(self, X, verbose=0, batch_size=None):
+        hidden = np.asarray(X, dtype="float32")
+        for kernel, bias, activation in zip(
+            self.kernels, self.biases, self.activations
+        ):
+            hidden = hidden @ kernel + bias
+            if activation == "relu":
+                np.maximum(hidden, 0, out=hidden)
+            elif activation != "linear":
+                raise ValueError(f"Неподдерживаемая активация: {activation}")
+        return hidden
+
+
+class NumpyScaler:
+    def __init__(self, mean, scale):
+        self.mean_ = np.asarray(mean, dtype="float64")
+        self.scale_ = np.asarray(scale, dtype="float64")
+
+    @classmethod
+    def from_sklearn(cls, scaler):
+        return cls(scaler.mean_, scaler.scale_)
+
+    def transform(self, X):
+        return (np.asarray(X, dtype="float64") - self.mean_) / self.scale_
+
+
+def is_dense_stack(model):
+    return all(
+        type(layer).__name__ == "Dense"
+        for layer in model.layers
+        if type(layer).__name__ != "InputLayer"
+    )
+
+
+def export_numpy_model(model, scaler, feature_columns, path):
+    numpy_model = model
+    if not isinstance(model, NumpyDenseModel):
+        numpy_model = NumpyDenseModel.from_keras(model)
+    arrays = {
+        "scaler_mean": np.asarray(scaler.mean_),
+        "scaler_scale": np.asarray(scaler.scale_),
+        "feature_columns": np.asarray(feature_columns, dtype=str),
+        "activations": np.asarray(numpy_model.activations, dtype=str),
+    }
+    for index, (kernel, bias) in enumerate(
+        zip(numpy_model.kernels, numpy_model.biases)
+    ):
+        arrays[f"kernel_{index}"] = kernel
+        arrays[f"bias_{index}"] = bias
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+
+def load_numpy_model(path):
+    with np.load(path) as arrays:
+        activations = [str(a) for a in arrays["activations"]]
+        model = NumpyDenseModel(
+            [arrays[f"kernel_{i}"] for i in range(len(activations))],
+            [arrays[f"bias_{i}"] for i in range(len(activations))],
+            activations,
+        )
+        scaler = NumpyScaler(arrays["scaler_mean"], arrays["scaler_scale"])
+        feature_columns = [str(c) for c in arrays["feature_columns"]]
+    return model, scaler, feature_columns
+
+
+def format_fingerprint(count, max_id, max_date, total):
+    return f"{count}:{max_id}:{max_date}:{total}"
+
+
+@timed("fingerprints")
+def item_fingerprints(db_session, item_ids=None):
+    query = db_session.query(
+        Sale.item_id,
+        func.count(Sale.id),
+        func.max(Sale.id),
+        func.max(Sale.sale_date),
+        func.sum(Sale.quantity),
+    )
+    if item_ids is not None:
+        query = query.filter(Sale.item_id.in_(item_ids))
+    rows = query.group_by(Sale.item_id).all()
+    return {item_id: format_fingerprint(*stats) for item_id, *stats in rows}
+
+
+def forecast_versions(registry, fingerprints, mode=None):
+    # Версия прогноза — отпечаток продаж, режим и время полного обучения
+    # модели: смена режима или переобучение тоже делают прогноз устаревшим
+    mode = mode or FORECAST_MODEL_MODE
+
+    def trained_at(item_id, fingerprint):
+        # Глобальная модель одна на все товары и без отчёта обучения
+        if mode == "global":
+            return ""
+        return registry.full_trained_at(item_id, fingerprint) or ""
+
+    return {
+        item_id: f"{fingerprint}|{mode}|{trained_at(item_id, fingerprint)}"
+        for item_id, fingerprint in fingerprints.items()
+    }
+
+
+class ModelRegistry:
+    def __init__(self, path=MODEL_REGISTRY_DIR, backend=INFERENCE_BACKEND):
+        self.path = path
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._loaded = {}
+        self._lock = threading.Lock()
+        self.flights = SingleFlight(os.path.join(path, ".locks"))
+        self.training_reports = {}
+
+    def _item_dir(self, item_id):
+        return os.path.join(self.path, f"item_{item_id}")
+
+    def _read_meta(self, item_id):
+        meta_path = os.path.join(self._item_dir(item_id), "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def _keras_model(self, item_id):
+        from tensorflow import keras
+
+        item_dir = self._item_dir(item_id)
+        keras_path = os.path.join(item_dir, "model.keras")
+        if os.path.exists(keras_path):
+            return keras.models.load_model(keras_path, compile=False)
+        # После пакетного обучения сохранены только веса NumPy
+        model, _, _ = load_numpy_model(os.path.join(item_dir, "model.npz"))
+        return model.to_keras()
+
+    def warm_start_base(self, item_id, feature_columns):
+        # Прошлая модель годится для дообучения, если признаки те же
+        # и полное обучение было не раньше FULL_RETRAIN_DAYS назад
+        meta = self._read_meta(item_id)
+        if meta is None or meta["feature_columns"] != list(feature_columns):
+            return None, "no_base"
+        training = meta.get("training") or {}
+        full_trained_at = training.get("full_trained_at")
+        if full_trained_at is None:
+            return None, "no_base"
+        age = datetime.utcnow() - datetime.fromisoformat(full_trained_at)
+        if age > timedelta(days=FULL_RETRAIN_DAYS):
+            return None, "schedule"
+
+        model = self._keras_model(item_id)
+        scaler_path = os.path.join(self._item_dir(item_id), "scaler.pkl")
+        with open(scaler_path, "rb") as f:
+            scaler = pickle.load(f)
+        return (model, scaler, training), None
+
+    def full_trained_at(self, item_id, fingerprint):
+        meta = self._read_meta(item_id)
+        if meta is None or meta["fingerprint"] != fingerprint:
+            return None
+        return (meta.get("training") or {}).get("full_trained_at")
+
+    def load(self, item_id, fingerprint):
+        cached = self._loaded.get(item_id)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+
+        meta = self._read_meta(item_id)
+        if meta is None or meta["fingerprint"] != fingerprint:
+            return None
+
+        item_dir = self._item_dir(item_id)
+        numpy_path = os.path.join(item_dir, "model.npz")
+        if self.backend == "numpy" and meta.get("numpy"):
+            entry = load_numpy_model(numpy_path)
+            self._loaded[item_id] = (fingerprint, entry)
+            return entry
+
+        model = self._keras_model(item_id)
+        with open(os.path.join(item_dir, "scaler.pkl"), "rb") as f:
+            scaler = pickle.load(f)
+
+        entry = (model, scaler, meta["feature_columns"])
+        self._loaded[item_id] = (fingerprint, entry)
+        return entry
+
+    def save(
+        self,
+        item_id,
+        fingerprint,
+        model,
+        scaler,
+        feature_columns,
+        training=None,
+    ):
+        item_dir = self._item_dir(item_id)
+        os.makedirs(item_dir, exist_ok=True)
+        # Уникальный суффикс: одну модель могут сохранять несколько процессов
+        tmp_suffix = uuid.uuid4().hex
+
+        # Метаданные пишутся последними, чтобы читатель не увидел
+        # новый отпечаток раньше самой модели
+        keras_path = os.path.join(item_dir, "model.keras")
+        if isinstance(model, NumpyDenseModel):
+            # Веса пакетного обучения пишутся сразу в формате NumPy;
+            # старый архив Keras удаляется, чтобы не прочитать его вместо них
+            try:
+                os.remove(keras_path)
+            except FileNotFoundError:
+                pass
+        else:
+            tmp_model = os.path.join(item_dir, f"model.{tmp_suffix}.keras")
+            model.save(tmp_model)
+            os.replace(tmp_model, keras_path)
+
+        tmp_scaler = os.path.join(item_dir, f"scaler.{tmp_suffix}.tmp")
+        with open(tmp_scaler, "wb") as f:
+            pickle.dump(scaler, f)
+        os.replace(tmp_scaler, os.path.join(item_dir, "scaler.pkl"))
+
+        # Модели из Dense-слоёв дополнительно сохраняются как массивы NumPy,
+        # чтобы веб-воркеры делали прогноз без импорта TensorFlow
+        exported = isinstance(model, NumpyDenseModel) or is_dense_stack(model)
+        if exported:
+            tmp_numpy = os.path.join(item_dir, f"model.{tmp_suffix}.npz")
+            export_numpy_model(model, scaler, feature_columns, tmp_numpy)
+            os.replace(tmp_numpy, os.path.join(item_dir, "model.npz"))
+
+        tmp_meta = os.path.join(item_dir, f"meta.{tmp_suffix}.tmp")
+        with open(tmp_meta, "w") as f:
+            json.dump(
+                {
+                    "fingerprint": fingerprint,
+                    "feature_columns": list(feature_columns),
+                    "numpy": exported,
+                    "training": training,
+                },
+                f,
+            )
+        os.replace(tmp_meta, os.path.join(item_dir, "meta.json"))
+
+        if self.backend == "numpy" and exported:
+            model = _as_numpy_model(model)
+            scaler = NumpyScaler.from_sklearn(scaler)
+        entry = (model, scaler, list(feature_columns))
+        self._loaded[item_id] = (fingerprint, entry)
+        if training is not None:
+            self.training_reports[item_id] = {
+                "fingerprint": fingerprint,
+                **training,
+            }
+        return entry
+
+    def record(self, hit):
+        # Под общей блокировкой только счётчики: разные товары
+        # обучаются параллельно
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        count("registry_hit" if hit else "registry_miss")
+
+    def get_or_train_with(self, item_id, fingerprint, train):
+        # Модель товара обучает один вызов на все воркеры хоста:
+        # остальные ждут блокировку товара и читают сохранённую им версию
+        with self.flights.lock(f"model_{item_id}"):
+            entry = self.load(item_id, fingerprint)
+            if entry is not None:
+                self.record(hit=True)
+                return entry
+
+            trained = train()
+            if trained is None:
+                return None
+
+            self.record(hit=False)
+            return self.save(item_id, fingerprint, *trained)
+
+    def get_or_train(
+        self, item_id, fingerprint, item_data, seed=None, features=None
+    ):
+        def train():
+            if features is not None:
+                X, y, feature_columns = features()
+            else:
+                X, y, feature_columns = preprocess_item_data(item_data)
+            if len(X) < 1:
+                return None
+
+            base, fallback = None, "disabled"
+            if WARM_START:
+                base, fallback = self.warm_start_base(item_id, feature_columns)
+            if base is not None:
+                model, scaler, previous = base
+                if detect_drift(scaler, X.iloc[-FINETUNE_ROWS:]):
+                    base, fallback = None, "drift"
+
+            report = {}
+            if base is not None:
+                model, scaler = fine_tune_item_model(
+                    model, scaler, X, y, seed=seed, report=report
+                )
+                report.update(
+                    mode="fine_tune",
+                    full_trained_at=previous["full_trained_at"],
+                    fine_tunes=previous.get("fine_tunes", 0) + 1,
+                )
+            else:
+                model, scaler = train_item_model(
+                    X, y, seed=seed, report=report
+                )
+                report.update(
+                    mode="full",
+                    fallback=fallback,
+                    full_trained_at=datetime.utcnow().isoformat(),
+                    fine_tunes=0,
+                )
+            return model, scaler, feature_columns, report
+
+        return self.get_or_train_with(item_id, fingerprint, train)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+model_registry = ModelRegistry()
+
+
+@timed("db_load")
+def load_sales_frame(
+    db_session,
+    item_ids=None,
+    lookback_rows=None,
+    chunk_size=SALES_CHUNK_SIZE,
+):
+    lookback_rows = lookback_rows or TRAINING_LOOKBACK_ROWS
+    columns = [Sale.item_id, Sale.sale_date, Sale.quantity]
+
+    if lookback_rows:
+        # Последние lookback_rows строк каждого товара считает сама БД,
+        # поэтому память зависит от окна, а не от размера таблицы
+        row_number = (
+            func.row_number()
+            .over(partition_by=Sale.item_id, order_by=Sale.sale_date.desc())
+            .label("row_number")
+        )
+        inner = select(*columns, row_number)
+        if item_ids is not None:
+            inner = inner.where(Sale.item_id.in_(item_ids))
+        inner = inner.subquery()
+        query = (
+            select(inner.c.item_id, inner.c.sale_date, inner.c.quantity)
+            .where(inner.c.row_number <= lookback_rows)
+            .order_by(inner.c.item_id, inner.c.sale_date)
+        )
+    else:
+        query = select(*columns)
+        if item_ids is not None:
+            query = query.where(Sale.item_id.in_(item_ids))
+        query = query.order_by(Sale.item_id, Sale.sale_date)
+
+    # yield_per включает серверный курсор там, где драйвер его умеет
+    result = db_session.execute(
+        query.execution_options(yield_per=chunk_size)
+    )
+    item_chunks, date_chunks, quantity_chunks = [], [], []
+    for rows in result.partitions():
+        items, dates, quantities = zip(*rows)
+        item_chunks.append(np.array(items, dtype="int32"))
+        date_chunks.append(np.array(dates, dtype="datetime64[D]"))
+        quantity_chunks.append(np.array(quantities, dtype="int32"))
+
+    if not item_chunks:
+        return pd.DataFrame(
+            {
+                "item_id": np.array([], dtype="int32"),
+                "sale_date": np.array([], dtype="datetime64[ns]"),
+                "quantity": np.array([], dtype="int32"),
+            }
+        )
 
-    data = pd.DataFrame(
+    return pd.DataFrame(
         {
-            "sale_date": [sale.sale_date for sale in sales],
-            "quantity": [sale.quantity for sale in sales],
-            "item_id": [sale.item_id for sale in sales],
+            "item_id": np.concatenate(item_chunks),
+            "sale_date": np.concatenate(date_chunks).astype("datetime64[ns]"),
+            "quantity": np.concatenate(quantity_chunks),
         }
     )
 
-    unique_items = data["item_id"].unique()
 
-    all_forecasts = []
+def load_training_frame(
+    db_session, item_ids=None, lookback_rows=None, snapshot=None
+):
+    # snapshot — каталог Parquet-снимка: из БД читаются только строки
+    # новее водяного знака, история — колоночным чтением с диска
+    if snapshot is None and USE_SALES_SNAPSHOT:
+        snapshot = SNAPSHOT_DIR
+    if snapshot is None:
+        return load_sales_frame(db_session, item_ids, lookback_rows)
+    return load_snapshot_frame(
+        db_session,
+        item_ids,
+        lookback_rows or TRAINING_LOOKBACK_ROWS,
+        path=snapshot,
+    )
+
+
+def load_item_sales(db_session, item_id, lookback_rows=None):
+    data = load_sales_frame(db_session, [item_id], lookback_rows)
+    return data[["sale_date", "quantity"]]
+
+
+def forecast_item(
+    registry,
+    item_id,
+    fingerprint,
+    item_data,
+    forecast_days=FORECAST_DAYS,
+    seed=None,
+    features=None,
+):
+    item_data = item_data.sort_values("sale_date")
+    item_data["sale_date"] = pd.to_datetime(item_data["sale_date"])
+
+    entry = registry.get_or_train(
+        item_id, fingerprint, item_data.copy(), seed=seed, features=features
+    )
+    if entry is None:
+        return []
+
+    return forecast_items_batched(
+        {item_id: entry}, {item_id: item_data}, forecast_days
+    )
 
-    for item in unique_items:
-        item_data = data[data["item_id"] == item].copy()
-        X, y, feature_columns = preprocess_item_data(item_data)
 
+_process_pool = None
+_process_pool_config = None
+_worker_registries = {}
+
+
+def _init_forecast_worker(tf_threads):
+    import tensorflow as tf
+
+    # Без ограничения каждый процесс занимает все ядра машины
+    tf.config.threading.set_intra_op_parallelism_threads(tf_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(tf_threads)
+
+
+def _forecast_item_task(
+    registry_path, item_id, fingerprint, item_data, seed, forecast_days
+):
+    registry = _worker_registries.get(registry_path)
+    if registry is None:
+        registry = _worker_registries[registry_path] = ModelRegistry(
+            registry_path
+        )
+    hits, misses = registry.hits, registry.misses
+    forecasts = forecast_item(
+        registry, item_id, fingerprint, item_data, forecast_days, seed=seed
+    )
+    return forecasts, registry.hits - hits, registry.misses - misses
+
+
+def get_process_pool(workers, tf_threads=TF_THREADS_PER_WORKER):
+    global _process_pool, _process_pool_config
+
+    if _process_pool_config != (workers, tf_threads):
+        if _process_pool is not None:
+            _process_pool.shutdown()
+        # spawn: fork процесса с уже загруженным TensorFlow небезопасен
+        _process_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_forecast_worker,
+            initargs=(tf_threads,),
+        )
+        _process_pool_config = (workers, tf_threads)
+    return _process_pool
+
+
+def forecast_with_global_model(
+    registry, data, fingerprints, forecast_days=FORECAST_DAYS, seed=None
+):
+    item_ids = sorted(int(item) for item in data["item_id"].unique())
+    item_positions = {item: index for index, item in enumerate(item_ids)}
+
+    def train():
+        X, items, y = preprocess_global_data(data)
         if len(X) < 1:
-            continue
+            return None
+        item_index = items.map(item_positions).to_numpy()
+        model, scaler = train_global_model(
+            X, item_index, y, len(item_ids), seed=seed
+        )
+        return model, scaler, GLOBAL_FEATURES
+
+    # Отпечаток покрывает и набор товаров, поэтому индексы эмбеддингов
+    # восстанавливаются из отсортированного списка item_id
+    entry = registry.get_or_train_with(
+        "global", global_fingerprint(fingerprints), train
+    )
+    if entry is None:
+        return []
+
+    model, scaler, _ = entry
+    return forecast_global(model, scaler, item_ids, data, forecast_days)
+
+
+def forecast_with_batched_training(
+    registry,
+    data,
+    fingerprints,
+    forecast_days=FORECAST_DAYS,
+    seed=None,
+    features=None,
+):
+    entries = {}
+    item_frames = {}
+    to_train = []
+
+    # Блокировки товаров держатся до сохранения моделей. Товары идут
+    # по возрастанию id, поэтому два пакетных вызова не ждут друг друга
+    # по кругу
+    with ExitStack() as flights:
+        for item, item_data in data.groupby("item_id", sort=True):
+            item = int(item)
+            item_data = item_data.sort_values("sale_date")
+            item_data["sale_date"] = pd.to_datetime(item_data["sale_date"])
+            item_frames[item] = item_data
+
+            entry = registry.load(item, fingerprints[item])
+            if entry is None:
+                # Пока ждали, модель мог обучить другой воркер
+                flights.enter_context(registry.flights.lock(f"model_{item}"))
+                entry = registry.load(item, fingerprints[item])
+            if entry is not None:
+                registry.record(hit=True)
+                entries[item] = entry
+                continue
+
+            if features is not None:
+                X, y, feature_columns = features(item)()
+            else:
+                X, y, feature_columns = preprocess_item_data(item_data.copy())
+            if len(X) >= 1:
+                to_train.append((item, X, y, feature_columns))
+
+        reports = []
+        trained = train_item_models_batched(
+            [(X, y) for _, X, y, _ in to_train], seed=seed, reports=reports
+        )
+        for (item, _, _, feature_columns), (model, scaler), report in zip(
+            to_train, trained, reports
+        ):
+            # Пакетное обучение полное: от него можно дообучаться
+            report.update(
+                mode="full",
+                full_trained_at=datetime.utcnow().isoformat(),
+                fine_tunes=0,
+            )
+            registry.record(hit=False)
+            entries[item] = registry.save(
+                item,
+                fingerprints[item],
+                model,
+                scaler,
+                feature_columns,
+                report,
+            )
+
+    entries = {item: entries[item] for item in item_frames if item in entries}
+    return forecast_items_batched(entries, item_frames, forecast_days)
+
+
+def forecast_with_dynamic_features(
+    db_session,
+    registry=None,
+    workers=None,
+    seed=None,
+    mode=None,
+    lookback_rows=None,
+    item_ids=None,
+    snapshot=None,
+    forecast_days=FORECAST_DAYS,
+):
+    registry = registry or model_registry
+    workers = workers or FORECAST_WORKERS
+    mode = mode or FORECAST_MODEL_MODE
+    if snapshot is None and USE_SALES_SNAPSHOT:
+        snapshot = SNAPSHOT_DIR
+    if mode == "global":
+        # Глобальная модель обучается на всех товарах сразу
+        item_ids = None
+
+    if snapshot is None:
+        data = load_sales_frame(db_session, item_ids, lookback_rows)
+        if data.empty:
+            return []
+        fingerprints = item_fingerprints(db_session, item_ids)
+    else:
+        # Отпечатки берутся из счётчиков манифеста: повторный запуск
+        # читает из БД только строки новее водяного знака
+        data, stats = load_snapshot(
+            db_session,
+            item_ids,
+            lookback_rows or TRAINING_LOOKBACK_ROWS,
+            path=snapshot,
+        )
+        if data.empty:
+            return []
+        fingerprints = {
+            item_id: format_fingerprint(*item_stats)
+            for item_id, item_stats in stats.items()
+        }
+
+    features = None
+    if USE_FEATURE_STORE and snapshot is None:
+        # Признаки обучения читаются из инкрементального хранилища,
+        # окно истории то же, что у load_sales_frame. Со снимком признаки
+        # строятся из его кадра, второй проход по БД не нужен
+        features = partial(
+            feature_loader,
+            db_session,
+            lookback_rows=lookback_rows or TRAINING_LOOKBACK_ROWS,
+        )
+
+    if mode == "global":
+        return forecast_with_global_model(
+            registry, data, fingerprints, forecast_days, seed=seed
+        )
+    if mode == "batched":
+        return forecast_with_batched_training(
+            registry,
+            data,
+            fingerprints,
+            forecast_days,
+            seed=seed,
+            features=features,
+        )
+
+    item_frames = {
+        int(item): frame for item, frame in data.groupby("item_id", sort=True)
+    }
+    unique_items = list(item_frames)
+    item_seeds = [
+        None if seed is None else seed + item for item in unique_items
+    ]
 
-        model, scaler = train_item_model(X, y)
+    all_forecasts = []
+
+    if workers > 1:
+        # map сохраняет порядок товаров независимо от порядка завершения
+        results = get_process_pool(workers).map(
+            _forecast_item_task,
+            [str(registry.path)] * len(unique_items),
+            unique_items,
+            [fingerprints[item] for item in unique_items],
+            [item_frames[item] for item in unique_items],
+            item_seeds,
+            [forecast_days] * len(unique_items),
+        )
+        for forecasts, hits, misses in results:
+            registry.hits += hits
+            registry.misses += misses
+            all_forecasts.extend(forecasts)
+        return all_forecasts
 
-        forecast_days = 20
-        forecast_list = forecast_item_sales(
-            model, scaler, item_data, forecast_days, feature_columns
+    # Обучение идёт по товарам, а прогноз для всех считается одним проходом
+    entries = {}
+    for item, item_seed in zip(unique_items, item_seeds):
+        entry = registry.get_or_train(
+            item,
+            fingerprints[item],
+            item_frames[item].copy(),
+            seed=item_seed,
+            features=features(item) if features else None,
         )
+        if entry is not None:
+            entries[item] = entry
 
-        for forecast in forecast_list:
-            forecast["item_id"] = item
+    return forecast_items_batched(entries, item_frames, forecast_days)
 
-        all_forecasts.extend(forecast_list)
 
-    return all_forecasts
+def refresh_stale_forecasts(
+    db_session,
+    registry=None,
+    workers=None,
+    seed=None,
+    mode=None,
+    item_ids=None,
+):
+    # item_ids ограничивает проверку товарами, например задачей очереди
+    registry = registry or model_registry
+    mode = mode or FORECAST_MODEL_MODE
+    fingerprints = item_fingerprints(db_session, item_ids)
+    stale, removed = stale_items(
+        forecast_versions(registry, fingerprints, mode),
+        stored_versions(db_session, item_ids),
+    )
+    if stale:
+        # Сохраняется весь горизонт API, так что любой days читается
+        # из таблицы той же версии, без расчёта в запросе
+        forecasts = forecast_with_dynamic_features(
+            db_session,
+            registry,
+            workers=workers,
+            seed=seed,
+            mode=mode,
+            item_ids=stale,
+            forecast_days=FORECAST_STORED_DAYS,
+        )
+    else:
+        forecasts = []
+
+    # В глобальном режиме прогноз считается для всех товаров,
+    # но записываются только устаревшие
+    versions = forecast_versions(
+        registry, {item_id: fingerprints[item_id] for item_id in stale}, mode
+    )
+    versions.update((item_id, None) for item_id in removed)
+    written = write_forecasts(db_session, versions, forecasts)
+    return {"stale": stale, "removed": removed, "rows": written}
@@ -0,0 +1,243 @@
+import csv
+import io
+import json
+import os
+from datetime import date
+
+from sqlalchemy import delete, func, select, text
+from starlette.concurrency import run_in_threadpool
+
+from models import Sale
+
+
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "5000"))
+INGEST_MAX_ERRORS = 10
+SALE_COLUMNS = ("sale_date", "item_id", "quantity")
+# replace перезаписывает количество за день, accumulate прибавляет к нему
+UPSERT_MODES = ("replace", "accumulate")
+
+
+def check_mode(mode):
+    if mode not in UPSERT_MODES:
+        raise ValueError(f"Неподдерживаемый режим записи: {mode}")
+
+
+async def iter_lines(chunks):
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8").rstrip("\r")
+    if buffer:
+        yield buffer.decode("utf-8").rstrip("\r")
+
+
+def parse_sale(record):
+    sale_date = record["sale_date"]
+    if not isinstance(sale_date, date):
+        sale_date = date.fromisoformat(str(sale_date).strip()[:10])
+    item_id = int(record["item_id"])
+    quantity = int(record["quantity"])
+    if item_id < 1:
+        raise ValueError("item_id должен быть положительным")
+    if quantity < 0:
+        raise ValueError("quantity не может быть отрицательным")
+    return sale_date, item_id, quantity
+
+
+class RecordParser:
+    def __init__(self, fmt):
+        if fmt not in ("csv", "ndjson"):
+            raise ValueError(f"Неподдерживаемый формат: {fmt}")
+        self.fmt = fmt
+        self.header = None
+
+    def parse(self, line):
+        # None означает строку без данных (пустую или заголовок CSV)
+        if not line.strip():
+            return None
+        if self.fmt == "ndjson":
+            return parse_sale(json.loads(line))
+
+        values = next(csv.reader([line]))
+        if self.header is None:
+            header = [value.strip() for value in values]
+            missing = sorted(set(SALE_COLUMNS) - set(header))
+            if missing:
+                raise ValueError(
+                    f"В заголовке CSV нет колонок: {', '.join(missing)}"
+                )
+            self.header = header
+            return None
+        return parse_sale(dict(zip(self.header, values)))
+
+
+def upsert_statement(dialect_name, mode="replace"):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    statement = insert(Sale)
+    quantity = statement.excluded.quantity
+    if mode == "accumulate":
+        quantity = Sale.quantity + quantity
+    return statement.on_conflict_do_update(
+        index_elements=["sale_date", "item_id"], set_={"quantity": quantity}
+    )
+
+
+async def upsert_sale(db, sale_date, item_id, quantity, mode="replace"):
+    # Повтор той же продажи с кассы не падает на уникальном ключе:
+    # один INSERT ... ON CONFLICT сразу возвращает итоговое количество
+    check_mode(mode)
+    statement = upsert_statement(db.bind.dialect.name, mode)
+    result = await db.execute(
+        statement.values(
+            sale_date=sale_date, item_id=item_id, quantity=quantity
+        ).returning(Sale.quantity)
+    )
+    stored = result.scalar_one()
+    await db.commit()
+    return stored
+
+
+def delete_duplicate_sales(db):
+    # Одним DELETE оставляем самую раннюю строку каждой пары (дата, товар)
+    keep = select(func.min(Sale.id)).group_by(Sale.sale_date, Sale.item_id)
+    result = db.execute(delete(Sale).where(Sale.id.not_in(keep)))
+    db.commit()
+    return result.rowcount
+
+
+def _upsert_batch_copy(db, rows, mode):
+    db.execute(
+        text(
+            "CREATE TEMP TABLE IF NOT EXISTS sales_staging "
+            "(sale_date date, item_id integer, quantity integer) "
+            "ON COMMIT DELETE ROWS"
+        )
+    )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(
+        (sale_date.isoformat(), item_id, quantity)
+        for sale_date, item_id, quantity in rows
+    )
+    buffer.seek(0)
+
+    copy_sql = (
+        "COPY sales_staging (sale_date, item_id, quantity) "
+        "FROM STDIN WITH (FORMAT csv)"
+    )
+    cursor = db.connection().connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):
+            cursor.copy_expert(copy_sql, buffer)
+        else:
+            # psycopg 3
+            with cursor.copy(copy_sql) as copy:
+                copy.write(buffer.getvalue())
+    finally:
+        cursor.close()
+
+    quantity = "EXCLUDED.quantity"
+    if mode == "accumulate":
+        quantity = "sales.quantity + EXCLUDED.quantity"
+    db.execute(
+        text(
+            "INSERT INTO sales (sale_date, item_id, quantity) "
+            "SELECT sale_date, item_id, quantity FROM sales_staging "
+            "ON CONFLICT ON CONSTRAINT unique_sale_date_item "
+            f"DO UPDATE SET quantity = {quantity}"
+        )
+    )
+
+
+def _upsert_batch_insert(db, rows, mode):
+    db.execute(
+        upsert_statement(db.get_bind().dialect.name, mode),
+        [
+            {"sale_date": sale_date, "item_id": item_id, "quantity": quantity}
+            for sale_date, item_id, quantity in rows
+        ],
+    )
+
+
+def upsert_batch(db, rows, mode="replace"):
+    # Повтор пары (дата, товар) внутри батча ломает ON CONFLICT DO UPDATE,
+    # поэтому побеждает последняя строка, а в accumulate они суммируются
+    check_mode(mode)
+    unique_rows = {}
+    for sale_date, item_id, quantity in rows:
+        key = (sale_date, item_id)
+        if mode == "accumulate" and key in unique_rows:
+            quantity += unique_rows[key][2]
+        unique_rows[key] = (sale_date, item_id, quantity)
+    rows = list(unique_rows.values())
+    if not rows:
+        return 0
+
+    if db.get_bind().dialect.name == "postgresql":
+        _upsert_batch_copy(db, rows, mode)
+    else:
+        _upsert_batch_insert(db, rows, mode)
+    db.commit()
+    return len(rows)
+
+
+async def ingest_stream(
+    db,
+    chunks,
+    fmt,
+    batch_size=INGEST_BATCH_SIZE,
+    on_items=None,
+    mode="replace",
+):
+    check_mode(mode)
+    parser = RecordParser(fmt)
+    report = {"batches": [], "accepted": 0, "rejected": 0}
+    batch = {"rows": [], "rejected": 0, "errors": []}
+    line_number = 0
+
+    async def flush():
+        if not batch["rows"] and not batch["rejected"]:
+            return
+        accepted = len(batch["rows"])
+        if batch["rows"]:
+            await run_in_threadpool(upsert_batch, db, batch["rows"], mode)
+            if on_items is not None:
+                on_items({item_id for _, item_id, _ in batch["rows"]})
+        report["batches"].append(
+            {
+                "batch": len(report["batches"]) + 1,
+                "accepted": accepted,
+                "rejected": batch["rejected"],
+                "errors": batch["errors"],
+            }
+        )
+        report["accepted"] += accepted
+        report["rejected"] += batch["rejected"]
+        batch.update(rows=[], rejected=0, errors=[])
+
+    async for line in iter_lines(chunks):
+        line_number += 1
+        try:
+            row = parser.parse(line)
+        except (ValueError, KeyError, TypeError) as error:
+            if parser.header is None and fmt == "csv":
+                raise
+            batch["rejected"] += 1
+            if len(batch["errors"]) < INGEST_MAX_ERRORS:
+                batch["errors"].append(
+                    {"line": line_number, "error": str(error)}
+                )
+        else:
+            if row is not None:
+                batch["rows"].append(row)
+        if len(batch["rows"]) + batch["rejected"] >= batch_size:
+            await flush()
+
+    await flush()
+    return report
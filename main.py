@@ -1,4 +1,6 @@
-from datetime import datetime, timedelta
+import hashlib
+import json
+from datetime import date, datetime, timedelta
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi import (
     FastAPI,
@@ -8,15 +10,29 @@ from fastapi import (
     HTTPException,
     status,
     Response,
+    Query,
 )
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import RedirectResponse, HTMLResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from fastapi.responses import (
+    RedirectResponse,
+    HTMLResponse,
+    JSONResponse,
+    StreamingResponse,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import desc, select
+from starlette.concurrency import run_in_threadpool
 from models import Base, Sale, UserModel
 from schemas import User, SaleCreate
-from database import engine, get_db
-from forecasting import forecast_with_dynamic_features
+from database import engine, get_async_db, get_db
+from backends import forecast_backend
+from forecast_store import FORECAST_STORED_DAYS
+from ingestion import ingest_stream, upsert_sale
+from export import EXPORT_MEDIA_TYPES, export_stream
+from sales_history import SALES_PAGE_LIMIT, SALES_PAGE_MAX_LIMIT, sales_page
+from passwords import PasswordPoolBusy, password_hasher
+from metrics import MetricsMiddleware, render_metrics, timed
 from authenticate import (
     authenticate_user,
     get_user_roles,
@@ -29,12 +45,16 @@ from authenticate import (
 Base.metadata.create_all(bind=engine)
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
 templates = Jinja2Templates(directory="templates")
 
 
 @app.get("/register", response_class=HTMLResponse)
 async def get_register_page(request: Request):
-    return templates.TemplateResponse("register.html", {"request": request})
+    with timed("render"):
+        return templates.TemplateResponse(
+            "register.html", {"request": request}
+        )
 
 
 @app.post("/register")
@@ -42,13 +62,22 @@ async def create_user(
     username: str = Form(...),
     email: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    db_user = UserModel(username=username, email=email)
-    db_user.set_password(password)
+    try:
+        password_hash = await password_hasher.hash(password)
+    except PasswordPoolBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервер перегружен, повторите попытку позже",
+            headers={"Retry-After": "1"},
+        )
+
+    db_user = UserModel(
+        username=username, email=email, password_hash=password_hash
+    )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
 
     return RedirectResponse(url="/", status_code=303)
 
@@ -58,11 +87,29 @@ async def login(
     response: Response,
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    user = db.query(UserModel).filter(UserModel.username == username).first()
+    result = await db.execute(
+        select(UserModel)
+        .options(selectinload(UserModel.roles))
+        .where(UserModel.username == username)
+    )
+    user = result.scalar_one_or_none()
+    # Соединение возвращается в пул до медленной проверки пароля
+    await db.close()
+
+    try:
+        password_ok = user is not None and await password_hasher.verify(
+            password, user.password_hash
+        )
+    except PasswordPoolBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервер перегружен, повторите попытку позже",
+            headers={"Retry-After": "1"},
+        )
 
-    if not user or not user.check_password(password):
+    if not password_ok:
         return RedirectResponse(
             url="/register", status_code=status.HTTP_303_SEE_OTHER
         )
@@ -87,13 +134,20 @@ async def logout(response: Response):
 
 
 @app.get("/", response_class=HTMLResponse)
-def read_root(
+async def read_root(
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user),
 ):
-    forecast_list = forecast_with_dynamic_features(db)
-    past_sales = db.query(Sale).order_by(desc(Sale.sale_date)).limit(20).all()
+    # Прогнозы страница подгружает через /api/forecast по выбранному товару
+    result = await db.execute(
+        select(Sale.item_id).distinct().order_by(Sale.item_id)
+    )
+    item_ids = result.scalars().all()
+    result = await db.execute(
+        select(Sale).order_by(desc(Sale.sale_date)).limit(20)
+    )
+    past_sales = result.scalars().all()
 
     past_sales_list = [
         {
@@ -104,73 +158,237 @@ def read_root(
         for sale in past_sales
     ]
 
-    return templates.TemplateResponse(
-        request=request,
-        name="index.html",
-        context={
-            "forecast": forecast_list,
-            "past_sales": past_sales_list,
-            "current_user": current_user,
-        },
+    with timed("render"):
+        return templates.TemplateResponse(
+            request=request,
+            name="index.html",
+            context={
+                "item_ids": item_ids,
+                "past_sales": past_sales_list,
+                "current_user": current_user,
+            },
+        )
+
+
+def forecast_etag(versions, forecast_days):
+    # Ответ любой длины читается из сохранённых строк версии товара,
+    # так что ETag меняется только вместе с телом ответа
+    payload = json.dumps(
+        [forecast_days, sorted(versions.items())], separators=(",", ":")
+    )
+    return '"' + hashlib.sha256(payload.encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+@app.get("/api/forecast")
+async def get_forecast(
+    request: Request,
+    item_id: list[int] = Query(...),
+    days: int | None = Query(None, ge=1, le=FORECAST_STORED_DAYS),
+    db: Session = Depends(get_db),
+):
+    item_ids = sorted(set(item_id))
+    versions = await run_in_threadpool(
+        forecast_backend.item_versions, db, item_ids
+    )
+    etag = forecast_etag(versions, days)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    forecast_list = await run_in_threadpool(
+        forecast_backend.item_forecasts, db, item_ids, days
+    )
+    return JSONResponse(
+        {"item_ids": item_ids, "forecast": forecast_list}, headers=headers
     )
 
 
 @app.post("/add_sale")
-def add_sale(
+async def add_sale(
     sale_date: str = Form(...),
     quantity: int = Form(...),
     item_id: int = Form(...),
+    mode: str = Form("replace"),
     current_user: UserModel = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    if "admin" not in current_user.roles:
+    if not current_user or "admin" not in get_user_roles(current_user):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Operation not permitted. Admin role required.",
         )
 
     sale_date = datetime.strptime(sale_date, "%Y-%m-%d").date()
-    new_sale = Sale(sale_date=sale_date, quantity=quantity, item_id=item_id)
-    db.add(new_sale)
-    db.commit()
+    try:
+        await upsert_sale(db, sale_date, item_id, quantity, mode)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    forecast_backend.mark_dirty(item_id)
     return RedirectResponse(url="/", status_code=303)
 
 
 @app.post("/sales")
-def create_sale(
+async def create_sale(
     sale: SaleCreate,
-    db: Session = Depends(get_db),
+    mode: str = Query("replace"),
+    db: AsyncSession = Depends(get_async_db),
     current_user: UserModel = Depends(get_current_user),
 ):
     if not current_user or "admin" not in get_user_roles(current_user):
         raise HTTPException(status_code=403, detail="Недостаточно прав")
-    db_sale = Sale(
-        sale_date=sale.sale_date.date(),
-        quantity=sale.quantity,
-        item_id=sale.item_id,
-    )
-    db.add(db_sale)
-    db.commit()
-    db.refresh(db_sale)
+    sale_date = sale.sale_date.date()
+    try:
+        quantity = await upsert_sale(
+            db, sale_date, sale.item_id, sale.quantity, mode
+        )
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    forecast_backend.mark_dirty(sale.item_id)
     return {
         "message": "Продажа успешно добавлена.",
         "sale": {
-            "sale_date": db_sale.sale_date,
-            "quantity": db_sale.quantity,
-            "item_id": db_sale.item_id,
+            "sale_date": sale_date,
+            "quantity": quantity,
+            "item_id": sale.item_id,
         },
     }
 
 
-@app.get("/admin", response_class=HTMLResponse)
-def admin_dashboard(
+@app.get("/api/sales")
+async def list_sales(
+    item_id: int | None = Query(None),
+    date_from: date | None = Query(None),
+    date_to: date | None = Query(None),
+    cursor: str | None = Query(None),
+    limit: int = Query(SALES_PAGE_LIMIT, ge=1, le=SALES_PAGE_MAX_LIMIT),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserModel = Depends(get_current_user),
+):
+    if not current_user or "admin" not in get_user_roles(current_user):
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+
+    try:
+        return await sales_page(
+            db,
+            limit=limit,
+            item_id=item_id,
+            date_from=date_from,
+            date_to=date_to,
+            cursor=cursor,
+            descending=order == "desc",
+        )
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+@app.post("/sales/bulk")
+async def bulk_create_sales(
     request: Request,
+    format: str | None = Query(None),
+    mode: str = Query("replace"),
     db: Session = Depends(get_db),
     current_user: UserModel = Depends(get_current_user),
 ):
     if not current_user or "admin" not in get_user_roles(current_user):
         raise HTTPException(status_code=403, detail="Недостаточно прав")
 
-    return templates.TemplateResponse(
-        "admin.html", {"request": request, "current_user": current_user}
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        is_ndjson = "ndjson" in content_type or "jsonl" in content_type
+        format = "ndjson" if is_ndjson else "csv"
+
+    def mark_items(item_ids):
+        for item_id in item_ids:
+            forecast_backend.mark_dirty(item_id)
+
+    try:
+        return await ingest_stream(
+            db, request.stream(), format, on_items=mark_items, mode=mode
+        )
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+@app.get("/api/export/{table}")
+async def export_table(
+    table: str,
+    format: str = Query("csv"),
+    gzip: bool = Query(False),
+    current_user: UserModel = Depends(get_current_user),
+):
+    if not current_user or "admin" not in get_user_roles(current_user):
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+
+    try:
+        chunks = export_stream(table, format, compress=gzip)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="{table}.{format}"'
+    }
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        chunks, media_type=EXPORT_MEDIA_TYPES[format], headers=headers
     )
+
+
+@app.get("/admin", response_class=HTMLResponse)
+async def admin_dashboard(
+    request: Request,
+    current_user: UserModel = Depends(get_current_user),
+):
+    if not current_user or "admin" not in get_user_roles(current_user):
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+
+    with timed("render"):
+        return templates.TemplateResponse(
+            "admin.html", {"request": request, "current_user": current_user}
+        )
+
+
+@app.post("/jobs/retrain")
+async def enqueue_retrain(
+    item_id: list[int] | None = Query(None),
+    current_user: UserModel = Depends(get_current_user),
+):
+    if not current_user or "admin" not in get_user_roles(current_user):
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+    return forecast_backend.enqueue(item_id)
+
+
+@app.get("/jobs/pending")
+async def list_pending_items(
+    current_user: UserModel = Depends(get_current_user),
+):
+    if not current_user or "admin" not in get_user_roles(current_user):
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+    return {"pending": forecast_backend.pending()}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(
+    job_id: str,
+    current_user: UserModel = Depends(get_current_user),
+):
+    if not current_user or "admin" not in get_user_roles(current_user):
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+    job = forecast_backend.job_status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+
+@app.get("/metrics")
+async def metrics():
+    content, media_type = render_metrics()
+    return Response(content=content, media_type=media_type)
@@ -3,12 +3,12 @@ import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from sqlalchemy import create_engine, func, select
+from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import Base, Sale, UserModel
 from datetime import date
-from collections import defaultdict
 import os
+from ingestion import delete_duplicate_sales
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
@@ -74,39 +74,9 @@ else:
     print("База данных уже содержит данные. Инициализация пропущена.")
 
 
-subq = (
-    db.query(Sale.sale_date, Sale.item_id)
-    .group_by(Sale.sale_date, Sale.item_id)
-    .having(func.count(Sale.id) > 1)
-    .subquery()
-)
-
-
-duplicates = (
-    db.query(Sale)
-    .join(
-        subq,
-        (Sale.sale_date == subq.c.sale_date)
-        & (Sale.item_id == subq.c.item_id),
-    )
-    .order_by(Sale.sale_date, Sale.id, Sale.item_id)
-    .all()
-)
-
-to_delete = []
-seen_dates = set()
-
-for sale in duplicates:
-    if sale.sale_date in seen_dates:
-        to_delete.append(sale)
-    else:
-        seen_dates.add(sale.sale_date)
-
-if to_delete:
-    for sale in to_delete:
-        db.delete(sale)
-    db.commit()
-    print(f"Удалено дубликатов: {len(to_delete)}")
+deleted = delete_duplicate_sales(db)
+if deleted:
+    print(f"Удалено дубликатов: {deleted}")
 else:
     print("Дубликаты не найдены.")
 
@@ -142,6 +112,7 @@ from database import get_db
 from models import Base, Sale, UserModel, RoleModel
 from datetime import date
 from database import get_db
+from authenticate import grant_role
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
@@ -180,9 +151,8 @@ def create_admin_user(db: SessionLocal):
             email=admin_email,
         )
         admin_user.set_password(admin_password)
-        admin_user.roles.append(admin_role)
         db.add(admin_user)
-        db.commit()
+        grant_role(db, admin_user, admin_role)
         print("Admin user created.")
     else:
         print("Admin user already exists.")
@@ -0,0 +1,27 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal
+from feature_store import rebuild_features
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Пересборка хранилища признаков из таблицы sales"
+    )
+    parser.add_argument("--item-id", type=int, action="append")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        result = rebuild_features(db, args.item_id)
+    finally:
+        db.close()
+    print(f"Пересчитано строк признаков: {result['appended']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal
+from forecasting import FORECAST_MODEL_MODE, refresh_stale_forecasts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Пересчёт устаревших прогнозов в таблице forecasts"
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["per_item", "global", "batched"],
+        default=FORECAST_MODEL_MODE,
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        result = refresh_stale_forecasts(
+            db, workers=args.workers, mode=args.mode
+        )
+    finally:
+        db.close()
+
+    print(
+        f"Обновлено товаров: {len(result['stale'])}, "
+        f"удалено: {len(result['removed'])}, "
+        f"записано строк: {result['rows']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
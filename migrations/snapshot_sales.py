@@ -0,0 +1,37 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal
+from snapshots import SNAPSHOT_DIR, rebuild_snapshot, sync_snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Сверка и дозапись Parquet-снимка продаж для обучения. "
+        "Загрузка при обучении только дописывает новые строки, правки и "
+        "удаления старых находит этот запуск, его ставят по расписанию"
+    )
+    parser.add_argument("--path", default=SNAPSHOT_DIR)
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.rebuild:
+            result = rebuild_snapshot(db, args.path)
+        else:
+            result = sync_snapshot(db, args.path)
+    finally:
+        db.close()
+    print(
+        f"Дописано строк: {result['appended']}, "
+        f"переписано товаров: {len(result['rebuilt'])}, "
+        f"удалено товаров: {len(result['removed'])}"
+    )
+
+
+if __name__ == "__main__":
+    main()
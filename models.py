@@ -1,16 +1,19 @@
 from sqlalchemy import (
+    BigInteger,
     Column,
     Integer,
     Date,
+    Float,
     String,
     DateTime,
     UniqueConstraint,
     ForeignKey,
+    Index,
     Table,
 )
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql import func
-import bcrypt
+from passwords import hash_password, verify_password
 
 
 Base = declarative_base()
@@ -26,9 +29,57 @@ class Sale(Base):
 
     __table_args__ = (
         UniqueConstraint("sale_date", "item_id", name="unique_sale_date_item"),
+        # История товара читается диапазоном по этому индексу
+        Index("ix_sales_item_id_sale_date", "item_id", "sale_date"),
     )
 
 
+class Forecast(Base):
+    __tablename__ = "forecasts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    item_id = Column(Integer, nullable=False)
+    target_date = Column(Date, nullable=False)
+    predicted_quantity = Column(Float, nullable=False)
+    # Отпечаток продаж, режим и время полного обучения модели прогноза
+    model_version = Column(String(100), nullable=False)
+    generated_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "item_id", "target_date", name="unique_forecast_item_date"
+        ),
+    )
+
+
+class SaleFeature(Base):
+    __tablename__ = "sales_features"
+
+    item_id = Column(Integer, primary_key=True)
+    sale_date = Column(Date, primary_key=True)
+    quantity = Column(Integer, nullable=False)
+    month_sin = Column(Float, nullable=False)
+    month_cos = Column(Float, nullable=False)
+    weekday_sin = Column(Float, nullable=False)
+    weekday_cos = Column(Float, nullable=False)
+    # Лаги по позиции строки в истории товара, NULL для первых строк
+    lag_1 = Column(Float)
+    lag_3 = Column(Float)
+    lag_7 = Column(Float)
+    lag_14 = Column(Float)
+
+
+class FeatureStoreItem(Base):
+    __tablename__ = "feature_store_items"
+
+    item_id = Column(Integer, primary_key=True)
+    last_date = Column(Date, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    quantity_total = Column(BigInteger, nullable=False)
+    # Последние количества товара в JSON, из них считаются лаги новых строк
+    tail = Column(String, nullable=False)
+
+
 user_roles = Table(
     "user_roles",
     Base.metadata,
@@ -51,14 +102,10 @@ class UserModel(Base):
     )
 
     def set_password(self, password: str):
-        self.password_hash = bcrypt.hashpw(
-            password.encode("utf-8"), bcrypt.gensalt()
-        ).decode("utf-8")
+        self.password_hash = hash_password(password)
 
     def check_password(self, password: str) -> bool:
-        return bcrypt.checkpw(
-            password.encode("utf-8"), self.password_hash.encode("utf-8")
-        )
+        return verify_password(password, self.password_hash)
 
 
 class RoleModel(Base):
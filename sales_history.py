@@ -0,0 +1,73 @@
+import base64
+import json
+from datetime import date
+
+from sqlalchemy import select, tuple_
+
+from models import Sale
+
+
+SALES_PAGE_LIMIT = 100
+SALES_PAGE_MAX_LIMIT = 1000
+
+
+def encode_cursor(item_id, sale_date):
+    raw = json.dumps([item_id, sale_date.isoformat()]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        item_id, sale_date = json.loads(base64.urlsafe_b64decode(cursor))
+        return int(item_id), date.fromisoformat(sale_date)
+    except (ValueError, TypeError):
+        raise ValueError("Некорректный курсор")
+
+
+def sales_page_query(
+    item_id=None,
+    date_from=None,
+    date_to=None,
+    cursor=None,
+    limit=SALES_PAGE_LIMIT,
+    descending=False,
+):
+    # Keyset-пагинация по (item_id, sale_date): следующая страница
+    # начинается с позиции в индексе, а не с OFFSET
+    key = tuple_(Sale.item_id, Sale.sale_date)
+    query = select(Sale)
+    if item_id is not None:
+        query = query.where(Sale.item_id == item_id)
+    if date_from is not None:
+        query = query.where(Sale.sale_date >= date_from)
+    if date_to is not None:
+        query = query.where(Sale.sale_date <= date_to)
+    if cursor is not None:
+        position = tuple_(*decode_cursor(cursor))
+        query = query.where(key < position if descending else key > position)
+    if descending:
+        query = query.order_by(Sale.item_id.desc(), Sale.sale_date.desc())
+    else:
+        query = query.order_by(Sale.item_id, Sale.sale_date)
+    # Лишняя строка показывает, есть ли следующая страница
+    return query.limit(limit + 1)
+
+
+async def sales_page(db, limit=SALES_PAGE_LIMIT, **filters):
+    result = await db.execute(sales_page_query(limit=limit, **filters))
+    sales = result.scalars().all()
+    next_cursor = None
+    if len(sales) > limit:
+        sales = sales[:limit]
+        next_cursor = encode_cursor(sales[-1].item_id, sales[-1].sale_date)
+    return {
+        "items": [
+            {
+                "item_id": sale.item_id,
+                "sale_date": sale.sale_date.isoformat(),
+                "quantity": sale.quantity,
+            }
+            for sale in sales
+        ],
+        "next_cursor": next_cursor,
+    }
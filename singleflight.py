@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка действует только внутри процесса
+    fcntl = None
+
+from metrics import count
+
+
+SINGLEFLIGHT_TIMEOUT = float(os.environ.get("SINGLEFLIGHT_TIMEOUT", "600"))
+SINGLEFLIGHT_POLL_SECONDS = 0.05
+
+
+class SingleFlight:
+    def __init__(self, directory, timeout=SINGLEFLIGHT_TIMEOUT):
+        self.directory = directory
+        self.timeout = timeout
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def _thread_lock(self, key):
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _acquire_file(self, key, deadline):
+        os.makedirs(self.directory, exist_ok=True)
+        handle = open(os.path.join(self.directory, f"{key}.lock"), "a")
+        while True:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return handle
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    handle.close()
+                    return None
+                time.sleep(SINGLEFLIGHT_POLL_SECONDS)
+
+    @contextmanager
+    def lock(self, key):
+        # Потоки процесса ждут на threading.Lock, воркеры uvicorn на хосте —
+        # на flock файла ключа. Файл один на ключ, поэтому ключом служит
+        # товар, а версию данных вызывающий перепроверяет под блокировкой.
+        # По таймауту считаем сами: зависший владелец не держит запросы
+        deadline = time.monotonic() + self.timeout
+        thread_lock = self._thread_lock(key)
+        started = time.perf_counter()
+        acquired = thread_lock.acquire(timeout=self.timeout)
+        handle = None
+        try:
+            if acquired and fcntl is not None:
+                handle = self._acquire_file(key, deadline)
+            if not acquired or (fcntl is not None and handle is None):
+                count("singleflight_timeout")
+            elif time.perf_counter() - started > SINGLEFLIGHT_POLL_SECONDS:
+                count("singleflight_wait")
+            yield
+        finally:
+            if handle is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+                handle.close()
+            if acquired:
+                thread_lock.release()
+
+    def run(self, key, fetch, compute):
+        # fetch возвращает готовый результат или None; compute вызывается,
+        # только если под блокировкой результата всё ещё нет
+        with self.lock(key):
+            result = fetch()
+            if result is not None:
+                count("singleflight_shared")
+                return result
+            return compute()
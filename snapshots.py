@@ -0,0 +1,281 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+
+from models import Sale
+from singleflight import SingleFlight
+
+
+USE_SALES_SNAPSHOT = os.environ.get("SALES_SNAPSHOT", "0") == "1"
+SNAPSHOT_DIR = os.environ.get("SALES_SNAPSHOT_DIR", "sales_snapshot")
+SNAPSHOT_MAX_PARTS = int(os.environ.get("SNAPSHOT_MAX_PARTS", "16"))
+MANIFEST_NAME = "_manifest.json"
+
+
+def _item_dir(path, item_id):
+    return os.path.join(path, f"item_id={item_id}")
+
+
+def read_manifest(path=SNAPSHOT_DIR):
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {"watermark": 0, "items": {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _write_manifest(path, manifest):
+    # Читатели видят либо старый, либо новый манифест целиком
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def _write_part(path, item_id, dates, quantities):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    item_dir = _item_dir(path, item_id)
+    os.makedirs(item_dir, exist_ok=True)
+    name = f"part-{uuid.uuid4().hex}.parquet"
+    table = pa.table(
+        {
+            "sale_date": pa.array(dates, pa.date32()),
+            "quantity": pa.array(quantities, pa.int32()),
+        }
+    )
+    pq.write_table(table, os.path.join(item_dir, name + ".tmp"))
+    os.replace(
+        os.path.join(item_dir, name + ".tmp"), os.path.join(item_dir, name)
+    )
+    return name
+
+
+def _read_item(path, item_id, parts):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # memory_map: страницы файла читаются ОС по мере надобности
+    item_dir = _item_dir(path, item_id)
+    table = pa.concat_tables(
+        pq.read_table(os.path.join(item_dir, part), memory_map=True)
+        for part in parts
+    )
+    return (
+        table.column("sale_date").to_numpy(),
+        table.column("quantity").to_numpy(),
+    )
+
+
+def _rows_query(*criteria):
+    return (
+        select(Sale.item_id, Sale.id, Sale.sale_date, Sale.quantity)
+        .where(*criteria)
+        .order_by(Sale.item_id, Sale.sale_date)
+    )
+
+
+def _sales_rows(db_session, query):
+    grouped = {}
+    result = db_session.execute(query.execution_options(yield_per=50000))
+    for rows in result.partitions():
+        for item_id, sale_id, sale_date, quantity in rows:
+            grouped.setdefault(item_id, ([], [], []))
+            grouped[item_id][0].append(sale_date)
+            grouped[item_id][1].append(quantity)
+            grouped[item_id][2].append(sale_id)
+    return {
+        item_id: (
+            np.array(dates, dtype="datetime64[D]"),
+            np.array(quantities, dtype="int32"),
+            max(ids),
+        )
+        for item_id, (dates, quantities, ids) in grouped.items()
+    }
+
+
+def _sync(db_session, path, verify):
+    manifest = read_manifest(path)
+    items = manifest["items"]
+    # Все запросы ограничены одним максимальным id, чтобы параллельная
+    # запись продаж не попала в снимок дважды
+    upper = db_session.scalar(select(func.max(Sale.id))) or 0
+
+    # Одним запросом забираем только строки новее водяного знака
+    new_rows = _sales_rows(
+        db_session,
+        _rows_query(Sale.id > manifest["watermark"], Sale.id <= upper),
+    )
+
+    appended, rebuild = {}, []
+    for item_id, rows in new_rows.items():
+        state = items.get(str(item_id))
+        if state and rows[0][0] <= np.datetime64(state["max_date"]):
+            # Продажа задним числом нарушила бы порядок частей по датам
+            rebuild.append(item_id)
+        else:
+            appended[item_id] = rows
+
+    removed = []
+    if verify:
+        # Правки и удаления строк ниже водяного знака видит только полная
+        # сверка с БД, поэтому она идёт в sync_snapshot, а не при загрузке
+        stats = db_session.execute(
+            select(Sale.item_id, func.count(Sale.id), func.sum(Sale.quantity))
+            .where(Sale.id <= upper)
+            .group_by(Sale.item_id)
+        )
+        seen = set()
+        for item_id, count, total in stats:
+            seen.add(item_id)
+            state = items.get(str(item_id))
+            expected = [
+                state["rows"] if state else 0,
+                state["quantity_total"] if state else 0,
+            ]
+            if item_id in new_rows:
+                quantities = new_rows[item_id][1]
+                expected[0] += len(quantities)
+                expected[1] += int(quantities.sum())
+            if expected != [count, int(total)] and item_id not in rebuild:
+                rebuild.append(item_id)
+                appended.pop(item_id, None)
+        removed = sorted(int(item) for item in items if int(item) not in seen)
+
+    appended_rows = sum(len(rows[0]) for rows in appended.values())
+    if rebuild:
+        rebuild.sort()
+        appended.update(
+            _sales_rows(
+                db_session,
+                _rows_query(Sale.item_id.in_(rebuild), Sale.id <= upper),
+            )
+        )
+
+    for item_id, (dates, quantities, max_id) in appended.items():
+        state = None if item_id in rebuild else items.get(str(item_id))
+        parts = state["parts"] if state else []
+        if len(parts) >= SNAPSHOT_MAX_PARTS:
+            # Компактим мелкие части дозаписей в один файл
+            old_dates, old_quantities = _read_item(path, item_id, parts)
+            dates = np.concatenate([old_dates, dates])
+            quantities = np.concatenate([old_quantities, quantities])
+            state, parts = None, []
+        part = _write_part(path, item_id, dates, quantities)
+        items[str(item_id)] = {
+            "rows": (state["rows"] if state else 0) + len(dates),
+            "quantity_total": (state["quantity_total"] if state else 0)
+            + int(quantities.sum()),
+            "max_id": max(state["max_id"] if state else 0, max_id),
+            "max_date": str(dates[-1]),
+            "parts": parts + [part],
+        }
+
+    for item_id in removed:
+        del items[str(item_id)]
+    manifest["watermark"] = max(manifest["watermark"], upper)
+    os.makedirs(path, exist_ok=True)
+    _write_manifest(path, manifest)
+
+    # Файлы, которых нет в новом манифесте, больше никто не прочитает
+    for item_id in removed:
+        shutil.rmtree(_item_dir(path, item_id), ignore_errors=True)
+    for item_id in rebuild + list(appended):
+        live = set(items[str(item_id)]["parts"])
+        item_dir = _item_dir(path, item_id)
+        for name in os.listdir(item_dir):
+            if name not in live:
+                os.remove(os.path.join(item_dir, name))
+
+    return {
+        "appended": appended_rows,
+        "rebuilt": rebuild,
+        "removed": removed,
+    }
+
+
+def _flights(path):
+    return SingleFlight(os.path.join(path, ".locks"))
+
+
+def sync_snapshot(db_session, path=SNAPSHOT_DIR):
+    # Полная сверка с БД; запускается по расписанию через
+    # migrations/snapshot_sales.py
+    with _flights(path).lock("snapshot"):
+        return _sync(db_session, path, verify=True)
+
+
+def rebuild_snapshot(db_session, path=SNAPSHOT_DIR):
+    with _flights(path).lock("snapshot"):
+        for name in os.listdir(path) if os.path.isdir(path) else []:
+            if name != ".locks":
+                target = os.path.join(path, name)
+                if os.path.isdir(target):
+                    shutil.rmtree(target)
+                else:
+                    os.remove(target)
+        return _sync(db_session, path, verify=True)
+
+
+def load_snapshot(
+    db_session, item_ids=None, lookback_rows=None, path=SNAPSHOT_DIR
+):
+    # Догоняем снимок только по строкам новее водяного знака и читаем
+    # его под той же блокировкой, чтобы параллельная синхронизация
+    # не удалила части. Кроме кадра возвращаются счётчики товаров
+    # из манифеста: (строк, max id, последняя дата, сумма количества)
+    with _flights(path).lock("snapshot"):
+        _sync(db_session, path, verify=False)
+        items = read_manifest(path)["items"]
+        selected = sorted(int(item) for item in items)
+        if item_ids is not None:
+            wanted = {int(item_id) for item_id in item_ids}
+            selected = [item for item in selected if item in wanted]
+
+        stats = {}
+        item_chunks, date_chunks, quantity_chunks = [], [], []
+        for item_id in selected:
+            state = items[str(item_id)]
+            stats[item_id] = (
+                state["rows"],
+                state["max_id"],
+                state["max_date"],
+                state["quantity_total"],
+            )
+            dates, quantities = _read_item(path, item_id, state["parts"])
+            if lookback_rows:
+                dates = dates[-lookback_rows:]
+                quantities = quantities[-lookback_rows:]
+            item_chunks.append(np.full(len(dates), item_id, dtype="int32"))
+            date_chunks.append(dates)
+            quantity_chunks.append(quantities)
+
+    if not item_chunks:
+        frame = pd.DataFrame(
+            {
+                "item_id": np.array([], dtype="int32"),
+                "sale_date": np.array([], dtype="datetime64[ns]"),
+                "quantity": np.array([], dtype="int32"),
+            }
+        )
+        return frame, stats
+    frame = pd.DataFrame(
+        {
+            "item_id": np.concatenate(item_chunks),
+            "sale_date": np.concatenate(date_chunks).astype("datetime64[ns]"),
+            "quantity": np.concatenate(quantity_chunks).astype("int32"),
+        }
+    )
+    return frame, stats
+
+
+def load_snapshot_frame(
+    db_session, item_ids=None, lookback_rows=None, path=SNAPSHOT_DIR
+):
+    return load_snapshot(db_session, item_ids, lookback_rows, path)[0]
@@ -0,0 +1,46 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, Sale
+
+
+SALES_START = date(2025, 1, 1)
+
+
+@pytest.fixture
+def session_factory(tmp_path_factory):
+    # Файл, а не :memory:, чтобы сессии из других потоков видели те же данные
+    path = tmp_path_factory.mktemp("db") / "sales.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def seed_sales(db):
+    # days — число дней или функция от товара, quantity — функция (день, товар)
+    def seed(items=(1,), days=20, quantity=lambda i, item: i % 7):
+        db.add_all(
+            Sale(
+                sale_date=SALES_START + timedelta(days=i),
+                quantity=quantity(i, item),
+                item_id=item,
+            )
+            for item in items
+            for i in range(days(item) if callable(days) else days)
+        )
+        db.commit()
+        return SALES_START
+
+    return seed
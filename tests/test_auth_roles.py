@@ -1,5 +1,9 @@
 import pytest
 from httpx import AsyncClient, ASGITransport
+from sqlalchemy import event
+
+from authenticate import create_access_token
+from database import async_engine
 from main import app
 
 
@@ -31,3 +35,25 @@ async def test_register_and_login():
         response = await ac.get("/")
         assert response.status_code == 200
         assert "Привет, testuser" in response.text
+
+
+@pytest.mark.asyncio
+async def test_admin_claims_need_no_db_queries():
+    token = create_access_token({"sub": "claims_admin", "roles": ["admin"]})
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+    try:
+        async with AsyncClient(
+            transport=ASGITransport(app),
+            base_url="http://testserver",
+            cookies={"access_token": token},
+        ) as ac:
+            response = await ac.get("/jobs/pending")
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+    assert response.status_code == 200
+    assert statements == []
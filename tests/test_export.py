@@ -0,0 +1,103 @@
+import gzip
+import json
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from export import export_stream
+from models import Base, Forecast, Sale
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    path = tmp_path / "sales.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add_all(
+        Sale(sale_date=date(2025, 1, day), quantity=day, item_id=item_id)
+        for item_id in (2, 1)
+        for day in range(1, 6)
+    )
+    db.add(
+        Forecast(
+            item_id=1,
+            target_date=date(2025, 1, 6),
+            predicted_quantity=2.5,
+            model_version="5:5:2025-01-05:15",
+            generated_at=datetime(2025, 1, 5, 12),
+        )
+    )
+    db.commit()
+    db.close()
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    yield async_sessionmaker(async_engine, expire_on_commit=False)
+    engine.dispose()
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+@pytest.mark.asyncio
+async def test_csv_export_streams_in_batches(session_factory):
+    chunks = await collect(
+        export_stream(
+            "sales", "csv", batch_size=3, session_factory=session_factory
+        )
+    )
+    # Заголовок и четыре пачки по три строки
+    assert len(chunks) == 5
+    lines = b"".join(chunks).decode().splitlines()
+    assert lines[0] == "item_id,sale_date,quantity"
+    assert lines[1] == "1,2025-01-01,1"
+    assert lines[-1] == "2,2025-01-05,5"
+    assert len(lines) == 11
+
+
+@pytest.mark.asyncio
+async def test_ndjson_forecast_export(session_factory):
+    chunks = await collect(
+        export_stream(
+            "forecasts", "ndjson", session_factory=session_factory
+        )
+    )
+    rows = [json.loads(line) for line in b"".join(chunks).splitlines()]
+    assert rows == [
+        {
+            "item_id": 1,
+            "target_date": "2025-01-06",
+            "predicted_quantity": 2.5,
+            "model_version": "5:5:2025-01-05:15",
+            "generated_at": "2025-01-05T12:00:00",
+        }
+    ]
+
+
+@pytest.mark.asyncio
+async def test_gzip_export_decompresses_to_plain_output(session_factory):
+    plain = await collect(
+        export_stream(
+            "sales", "ndjson", batch_size=4, session_factory=session_factory
+        )
+    )
+    compressed = await collect(
+        export_stream(
+            "sales",
+            "ndjson",
+            compress=True,
+            batch_size=4,
+            session_factory=session_factory,
+        )
+    )
+    assert gzip.decompress(b"".join(compressed)) == b"".join(plain)
+
+
+def test_export_rejects_unknown_table_and_format():
+    with pytest.raises(ValueError):
+        export_stream("users", "csv")
+    with pytest.raises(ValueError):
+        export_stream("sales", "xlsx")
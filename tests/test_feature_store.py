@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+import numpy as np
+import forecasting
+from feature_store import item_training_data, rebuild_features, sync_features
+from forecasting import (
+    ModelRegistry,
+    forecast_with_dynamic_features,
+    load_item_sales,
+    preprocess_item_data,
+)
+from models import Sale
+
+
+def history(i, item):
+    return (i * 7 + item) % 11
+
+
+def assert_matches_preprocess(db, item_id, lookback_rows=None):
+    X, y, columns = item_training_data(db, item_id, lookback_rows)
+    expected_X, expected_y, expected_columns = preprocess_item_data(
+        load_item_sales(db, item_id, lookback_rows)
+    )
+    assert columns == expected_columns
+    assert np.array_equal(X.to_numpy(), expected_X.to_numpy())
+    assert np.array_equal(y.to_numpy(), expected_y.to_numpy())
+
+
+def test_features_are_appended_incrementally(db, seed_sales):
+    start = seed_sales(items=(1, 2), days=30, quantity=history)
+    assert sync_features(db) == {"appended": 60, "rebuilt": []}
+    assert_matches_preprocess(db, 1)
+
+    db.add(Sale(sale_date=start + timedelta(days=30), quantity=4, item_id=1))
+    db.commit()
+    # Досчитывается только новая строка по сохранённому хвосту
+    assert sync_features(db) == {"appended": 1, "rebuilt": []}
+    assert_matches_preprocess(db, 1)
+    assert_matches_preprocess(db, 1, lookback_rows=10)
+    assert sync_features(db) == {"appended": 0, "rebuilt": []}
+
+
+def test_changed_history_rebuilds_item(db, seed_sales):
+    start = seed_sales(items=(1, 2), days=30, quantity=history)
+    sync_features(db)
+
+    sale = db.query(Sale).filter_by(item_id=2, sale_date=start).one()
+    sale.quantity = 100
+    db.commit()
+    assert sync_features(db) == {"appended": 0, "rebuilt": [2]}
+    assert_matches_preprocess(db, 2)
+
+    assert rebuild_features(db) == {"appended": 60, "rebuilt": []}
+    assert_matches_preprocess(db, 1)
+
+
+def test_training_features_use_lookback_window(
+    tmp_path, monkeypatch, db, seed_sales
+):
+    seed_sales(days=400, quantity=history)
+    rows = []
+
+    def batched(registry, data, fingerprints, days, seed=None, features=None):
+        X, _, _ = features(1)()
+        rows.append((len(data), len(X)))
+        return []
+
+    monkeypatch.setattr(forecasting, "forecast_with_batched_training", batched)
+    monkeypatch.setattr(forecasting, "USE_FEATURE_STORE", True)
+    monkeypatch.setattr(forecasting, "TRAINING_LOOKBACK_ROWS", 30)
+    forecast_with_dynamic_features(db, ModelRegistry(tmp_path), mode="batched")
+    # Признаки берут то же окно, что и таблица продаж, а не всю историю
+    assert rows == [(30, 16)]
@@ -1,10 +1,26 @@
+import subprocess
+import sys
+import threading
+import time
 import pandas as pd
 import numpy as np
+from datetime import timedelta
+from models import Sale
 from forecasting import (
+    ModelRegistry,
+    export_numpy_model,
+    load_numpy_model,
     preprocess_item_data,
     train_item_model,
+    train_item_models_batched,
     forecast_item_sales,
+    forecast_items_batched,
+    forecast_with_dynamic_features,
+    item_fingerprints,
+    load_sales_frame,
+    refresh_stale_forecasts,
 )
+from forecast_store import FORECAST_STORED_DAYS, read_forecasts
 
 
 def test_preprocess_item_data():
@@ -23,6 +39,25 @@ def test_preprocess_item_data():
     assert "weekday_cos" in X.columns
 
 
+def test_preprocess_item_data_counts_skipped_lags():
+    from metrics import EVENTS, STAGE_LATENCY
+
+    skipped = EVENTS.labels("lag_skipped")._value.get()
+    timings = STAGE_LATENCY.labels("preprocess")._sum.get()
+    data = pd.DataFrame(
+        {
+            "sale_date": pd.date_range(
+                start="2025-01-01", periods=5, freq="D"
+            ),
+            "quantity": np.arange(5),
+        }
+    )
+    preprocess_item_data(data)
+    # Лаги 7 и 14 не помещаются в пять дней истории
+    assert EVENTS.labels("lag_skipped")._value.get() == skipped + 2
+    assert STAGE_LATENCY.labels("preprocess")._sum.get() > timings
+
+
 def test_train_and_forecast():
     data = pd.DataFrame(
         {
@@ -43,3 +78,363 @@ def test_train_and_forecast():
         assert "date" in item
         assert "predicted_quantity" in item
         assert item["predicted_quantity"] >= 0
+
+
+def test_model_registry_skips_training_for_unchanged_data(
+    tmp_path, db, seed_sales
+):
+    start = seed_sales()
+
+    registry = ModelRegistry(tmp_path)
+    first = forecast_with_dynamic_features(db, registry=registry)
+    assert registry.stats() == {"hits": 0, "misses": 1}
+
+    second = forecast_with_dynamic_features(db, registry=registry)
+    assert registry.stats() == {"hits": 1, "misses": 1}
+    assert first == second
+
+    # Реестр на диске переживает перезапуск процесса
+    reloaded = ModelRegistry(tmp_path)
+    forecast_with_dynamic_features(db, registry=reloaded)
+    assert reloaded.stats() == {"hits": 1, "misses": 0}
+
+    db.add(Sale(sale_date=start + timedelta(days=20), quantity=3, item_id=1))
+    db.commit()
+    forecast_with_dynamic_features(db, registry=registry)
+    assert registry.stats() == {"hits": 1, "misses": 2}
+
+
+def test_registry_trains_different_items_in_parallel(tmp_path):
+    registry = ModelRegistry(tmp_path)
+    finished = {}
+
+    def request(item_id):
+        def train():
+            time.sleep(0.3)
+            finished[item_id] = time.monotonic()
+            return None
+
+        registry.get_or_train_with(item_id, "1:1:2025-01-01:1", train)
+
+    threads = [
+        threading.Thread(target=request, args=(item_id,))
+        for item_id in range(4)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Обучение товара ждёт только запросы того же товара
+    assert max(finished.values()) - started < 1.0
+
+
+def test_parallel_forecast_matches_serial(tmp_path, db, seed_sales):
+    seed_sales(items=(3, 1, 2), quantity=lambda i, item: (i * item) % 9)
+
+    serial = forecast_with_dynamic_features(
+        db, registry=ModelRegistry(tmp_path / "serial"), workers=1, seed=42
+    )
+    parallel_registry = ModelRegistry(tmp_path / "parallel")
+    parallel = forecast_with_dynamic_features(
+        db, registry=parallel_registry, workers=2, seed=42
+    )
+
+    assert parallel_registry.stats() == {"hits": 0, "misses": 3}
+    assert [f["item_id"] for f in parallel] == [f["item_id"] for f in serial]
+    assert [f["date"] for f in parallel] == [f["date"] for f in serial]
+    np.testing.assert_allclose(
+        [f["predicted_quantity"] for f in parallel],
+        [f["predicted_quantity"] for f in serial],
+        atol=0.05,
+    )
+
+
+def test_global_model_forecasts_all_items_in_one_model(
+    tmp_path, db, seed_sales
+):
+    seed_sales(
+        items=(2, 1),
+        days=lambda item: 10 * item,
+        quantity=lambda i, item: (i + item) % 6,
+    )
+
+    registry = ModelRegistry(tmp_path)
+    forecast = forecast_with_dynamic_features(
+        db, registry=registry, mode="global"
+    )
+    assert registry.stats() == {"hits": 0, "misses": 1}
+    assert len(forecast) == 40
+    assert [f["item_id"] for f in forecast] == [1] * 20 + [2] * 20
+    assert forecast[0]["date"] == "2025-01-11"
+    assert forecast[20]["date"] == "2025-01-21"
+    assert all(f["predicted_quantity"] >= 0 for f in forecast)
+
+    assert forecast_with_dynamic_features(
+        db, registry=registry, mode="global"
+    ) == forecast
+    assert registry.stats() == {"hits": 1, "misses": 1}
+
+
+def test_batched_training_keeps_per_item_models(tmp_path, db, seed_sales):
+    datasets = []
+    for periods in (10, 20, 20):
+        data = pd.DataFrame(
+            {
+                "sale_date": pd.date_range(
+                    start="2025-01-01", periods=periods, freq="D"
+                ),
+                "quantity": np.random.randint(1, 10, size=periods),
+            }
+        )
+        X, y, features = preprocess_item_data(data)
+        datasets.append((X, y))
+
+    trained = train_item_models_batched(datasets, seed=0)
+
+    assert len(trained) == 3
+    for (X, y), (model, scaler) in zip(datasets, trained):
+        predictions = model.predict(scaler.transform(X), verbose=0)
+        assert predictions.shape == (len(X), 1)
+        assert np.isfinite(predictions).all()
+    # У каждого товара свой скейлер и свои веса
+    assert trained[1][1] is not trained[2][1]
+    assert not np.allclose(trained[1][0].kernels[0], trained[2][0].kernels[0])
+
+    seed_sales(items=(1, 2), days=15, quantity=lambda i, item: i % 4)
+    registry = ModelRegistry(tmp_path)
+    forecast = forecast_with_dynamic_features(
+        db, registry=registry, mode="batched"
+    )
+    assert len(forecast) == 40
+    assert registry.stats() == {"hits": 0, "misses": 2}
+    forecast_with_dynamic_features(db, registry=registry, mode="batched")
+    assert registry.stats() == {"hits": 2, "misses": 2}
+
+    # Пакетное обучение сохраняет только веса NumPy, сеть Keras
+    # собирается из них по требованию
+    assert not (tmp_path / "item_1" / "model.keras").exists()
+    assert (tmp_path / "item_1" / "model.npz").exists()
+    fingerprint = item_fingerprints(db, [1])[1]
+    numpy_model, scaler, features = registry.load(1, fingerprint)
+    keras_model, _, _ = ModelRegistry(tmp_path, backend="keras").load(
+        1, fingerprint
+    )
+    X = np.random.rand(5, len(features))
+    np.testing.assert_allclose(
+        keras_model.predict(X, verbose=0),
+        numpy_model.predict(X),
+        rtol=1e-4,
+        atol=1e-4,
+    )
+    (base_model, _, training), _ = registry.warm_start_base(1, features)
+    assert training["mode"] == "full"
+    np.testing.assert_allclose(
+        base_model.predict(X, verbose=0), numpy_model.predict(X), atol=1e-4
+    )
+
+
+def test_numpy_export_matches_keras(tmp_path):
+    data = pd.DataFrame(
+        {
+            "sale_date": pd.date_range(
+                start="2025-01-01", periods=20, freq="D"
+            ),
+            "quantity": np.random.randint(1, 10, size=20),
+        }
+    )
+    X, y, features = preprocess_item_data(data)
+    model, scaler = train_item_model(X, y)
+
+    path = tmp_path / "model.npz"
+    export_numpy_model(model, scaler, features, path)
+    numpy_model, numpy_scaler, numpy_features = load_numpy_model(path)
+
+    assert numpy_features == features
+    np.testing.assert_allclose(numpy_scaler.transform(X), scaler.transform(X))
+    np.testing.assert_allclose(
+        numpy_model.predict(scaler.transform(X)),
+        model.predict(scaler.transform(X), verbose=0),
+        rtol=1e-4,
+        atol=1e-4,
+    )
+    assert len(
+        forecast_item_sales(numpy_model, numpy_scaler, data, 5, features)
+    ) == 5
+
+
+def test_forecasting_import_does_not_load_tensorflow():
+    code = (
+        "import sys, forecasting; "
+        "assert 'tensorflow' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_load_sales_frame_streams_typed_columns_with_lookback(db, seed_sales):
+    seed_sales(
+        items=(2, 1), days=lambda item: 5 * item, quantity=lambda i, item: i
+    )
+
+    full = load_sales_frame(db, chunk_size=3)
+    assert len(full) == 15
+    assert str(full["sale_date"].dtype) == "datetime64[ns]"
+    assert full["item_id"].dtype == np.int32
+    assert full["item_id"].tolist() == [1] * 5 + [2] * 10
+
+    window = load_sales_frame(db, lookback_rows=4, chunk_size=3)
+    assert window.groupby("item_id").size().to_dict() == {1: 4, 2: 4}
+    assert window[window["item_id"] == 2]["quantity"].tolist() == [6, 7, 8, 9]
+
+    only_first = load_sales_frame(db, item_ids=[1])
+    assert only_first["quantity"].tolist() == [0, 1, 2, 3, 4]
+    assert load_sales_frame(db, item_ids=[42]).empty
+
+
+def test_batched_forecast_matches_per_item_forecasts():
+    entries, frames = {}, {}
+    for item, periods in ((1, 10), (2, 20), (3, 20)):
+        data = pd.DataFrame(
+            {
+                "sale_date": pd.date_range(
+                    start="2025-05-20", periods=periods, freq="D"
+                ),
+                "quantity": np.random.randint(1, 10, size=periods),
+            }
+        )
+        X, y, features = preprocess_item_data(data)
+        model, scaler = train_item_model(X, y)
+        entries[item] = (model, scaler, features)
+        frames[item] = data
+
+    batched = forecast_items_batched(entries, frames, forecast_days=30)
+
+    expected = []
+    for item, (model, scaler, features) in entries.items():
+        for forecast in forecast_item_sales(
+            model, scaler, frames[item], 30, features
+        ):
+            expected.append({**forecast, "item_id": item})
+    assert batched == expected
+    assert batched[0]["date"] == "2025-05-30"
+    assert batched[-1]["date"] == "2025-07-08"
+
+
+def test_refresh_rewrites_only_stale_forecasts(tmp_path, db, seed_sales):
+    start = seed_sales(items=(1, 2), quantity=lambda i, item: (i + item) % 6)
+
+    registry = ModelRegistry(tmp_path)
+    result = refresh_stale_forecasts(db, registry)
+    # Хранится весь горизонт API, а не только дни по умолчанию
+    days = FORECAST_STORED_DAYS
+    assert result == {"stale": [1, 2], "removed": [], "rows": 2 * days}
+    stored = read_forecasts(db)
+    assert stored == forecast_with_dynamic_features(
+        db, registry=registry, forecast_days=days
+    )
+
+    assert refresh_stale_forecasts(db, registry)["stale"] == []
+
+    db.add(Sale(sale_date=start + timedelta(days=20), quantity=3, item_id=2))
+    db.commit()
+    result = refresh_stale_forecasts(db, registry)
+    assert result["stale"] == [2]
+    refreshed = read_forecasts(db)
+    assert refreshed[:days] == stored[:days]
+    assert refreshed[days]["date"] == "2025-01-22"
+    assert read_forecasts(db, [1], forecast_days=5) == stored[:5]
+
+    # Версия хранит режим: после его смены прогнозы пересчитываются,
+    # а модели той же версии данных берутся из реестра
+    misses = registry.stats()["misses"]
+    result = refresh_stale_forecasts(db, registry, mode="batched")
+    assert result["stale"] == [1, 2]
+    assert registry.stats()["misses"] == misses
+    assert refresh_stale_forecasts(db, registry, mode="batched")["stale"] == []
+
+
+def test_training_budget_bounds_epochs_time_and_rows():
+    rows = 300
+    data = pd.DataFrame(
+        {
+            "sale_date": pd.date_range(
+                start="2024-01-01", periods=rows, freq="D"
+            ),
+            "quantity": np.arange(rows) % 7,
+        }
+    )
+    X, y, _ = preprocess_item_data(data)
+
+    report = {}
+    train_item_model(
+        X,
+        y,
+        seed=0,
+        budget={"epochs": 200, "patience": 2, "max_rows": 100},
+        report=report,
+    )
+    assert report["rows"] + report["validation_rows"] == 100
+    assert report["validation_rows"] == 20
+    assert report["stop_reason"] == "early_stopping"
+    assert report["epochs"] < 200
+
+    report = {}
+    train_item_model(
+        X, y, seed=0, budget={"max_seconds": 1e-6}, report=report
+    )
+    assert report["epochs"] == 1
+    assert report["stop_reason"] == "time_limit"
+
+    reports = []
+    train_item_models_batched(
+        [(X, y), (X.iloc[:12], y.iloc[:12])],
+        seed=0,
+        budget={"epochs": 200, "patience": 2, "max_rows": 100},
+        reports=reports,
+    )
+    assert reports[0]["stop_reason"] == "early_stopping"
+    assert reports[0]["epochs"] < 200
+    # Короткому ряду валидация не выделяется, он идёт до потолка эпох
+    assert reports[1]["validation_rows"] == 0
+    assert reports[1]["stop_reason"] == "max_epochs"
+    assert reports[1]["epochs"] == 200
+
+
+def test_warm_start_fine_tunes_until_drift_or_schedule(tmp_path, monkeypatch):
+    import forecasting
+
+    def series(quantities):
+        return pd.DataFrame(
+            {
+                "sale_date": pd.date_range(
+                    start="2025-01-01", periods=len(quantities), freq="D"
+                ),
+                "quantity": quantities,
+            }
+        )
+
+    quantities = [i % 5 + 1 for i in range(60)]
+    registry = ModelRegistry(tmp_path)
+    registry.get_or_train(1, "v1", series(quantities), seed=0)
+    first = registry.training_reports[1]
+    assert first["mode"] == "full"
+    assert first["fallback"] == "no_base"
+
+    # Несколько новых дней дообучают прошлую модель
+    quantities += [3, 4, 2]
+    registry.get_or_train(1, "v2", series(quantities), seed=0)
+    report = registry.training_reports[1]
+    assert report["mode"] == "fine_tune"
+    assert report["epochs"] == forecasting.FINETUNE_EPOCHS
+    assert report["full_trained_at"] == first["full_trained_at"]
+    assert report["fine_tunes"] == 1
+
+    # Резкий рост продаж считается дрейфом
+    drifted = quantities + [60] * 20
+    registry.get_or_train(1, "v3", series(drifted), seed=0)
+    assert registry.training_reports[1]["mode"] == "full"
+    assert registry.training_reports[1]["fallback"] == "drift"
+
+    monkeypatch.setattr(forecasting, "FULL_RETRAIN_DAYS", 0)
+    registry.get_or_train(1, "v4", series(drifted + [61]), seed=0)
+    assert registry.training_reports[1]["fallback"] == "schedule"
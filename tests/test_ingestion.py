@@ -0,0 +1,123 @@
+import pytest
+from datetime import date
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from models import Base, Sale
+from ingestion import (
+    delete_duplicate_sales,
+    ingest_stream,
+    upsert_batch,
+    upsert_sale,
+)
+
+
+async def chunked(payload, size=7):
+    for start in range(0, len(payload), size):
+        yield payload[start : start + size]
+
+
+@pytest.mark.asyncio
+async def test_csv_upload_is_upserted_in_batches(db):
+    db.add(Sale(sale_date=date(2025, 1, 1), quantity=1, item_id=1))
+    db.commit()
+    payload = (
+        "item_id,sale_date,quantity\r\n"
+        "1,2025-01-01,5\r\n"
+        "1,2025-01-02,6\r\n"
+        "2,not-a-date,3\r\n"
+        "2,2025-01-02,-1\r\n"
+        "2,2025-01-03,4"
+    ).encode("utf-8")
+    touched = set()
+
+    report = await ingest_stream(
+        db, chunked(payload), "csv", batch_size=2, on_items=touched.update
+    )
+
+    assert report["accepted"] == 3
+    assert report["rejected"] == 2
+    assert [b["accepted"] for b in report["batches"]] == [2, 0, 1]
+    assert [b["rejected"] for b in report["batches"]] == [0, 2, 0]
+    assert report["batches"][1]["errors"][0]["line"] == 4
+    assert touched == {1, 2}
+
+    sales = db.query(Sale).order_by(Sale.item_id, Sale.sale_date).all()
+    assert [(s.item_id, s.sale_date.day, s.quantity) for s in sales] == [
+        (1, 1, 5),
+        (1, 2, 6),
+        (2, 3, 4),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_ndjson_upload_and_bad_csv_header(db):
+    payload = (
+        b'{"sale_date": "2025-02-01", "item_id": 3, "quantity": 2}\n'
+        b'{"sale_date": "2025-02-01", "item_id": 3, "quantity": 9}\n'
+        b"[1, 2, 3]\n"
+    )
+    report = await ingest_stream(db, chunked(payload), "ndjson")
+    assert report["accepted"] == 2
+    assert report["rejected"] == 1
+    assert db.query(Sale).filter_by(item_id=3).one().quantity == 9
+
+    with pytest.raises(ValueError):
+        await ingest_stream(db, chunked(b"item_id,qty\n1,2\n"), "csv")
+
+
+def test_accumulate_mode_sums_repeated_sales(db):
+    db.add(Sale(sale_date=date(2025, 1, 1), quantity=1, item_id=1))
+    db.commit()
+    rows = [
+        (date(2025, 1, 1), 1, 2),
+        (date(2025, 1, 1), 1, 3),
+        (date(2025, 1, 2), 1, 4),
+    ]
+    assert upsert_batch(db, rows, mode="accumulate") == 2
+    sales = db.query(Sale).order_by(Sale.sale_date).all()
+    assert [s.quantity for s in sales] == [6, 4]
+
+    with pytest.raises(ValueError):
+        upsert_batch(db, rows, mode="merge")
+
+
+@pytest.mark.asyncio
+async def test_repeated_sale_is_upserted_in_one_statement(tmp_path):
+    path = tmp_path / "sales.db"
+    Base.metadata.create_all(bind=create_engine(f"sqlite:///{path}"))
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with async_sessionmaker(engine)() as db:
+        sale_date = date(2025, 3, 1)
+        assert await upsert_sale(db, sale_date, 5, 2) == 2
+        # Повтор с кассы не падает на уникальном ключе
+        assert await upsert_sale(db, sale_date, 5, 2) == 2
+        assert await upsert_sale(db, sale_date, 5, 3, "accumulate") == 5
+        assert await upsert_sale(db, sale_date, 5, 1, "replace") == 1
+    await engine.dispose()
+
+
+def test_duplicates_are_deleted_per_item():
+    # Старые базы создавались без уникального ключа (дата, товар)
+    engine = create_engine("sqlite:///:memory:")
+    db = sessionmaker(bind=engine)()
+    db.execute(
+        text(
+            "CREATE TABLE sales (id INTEGER PRIMARY KEY, sale_date DATE, "
+            "quantity INTEGER, item_id INTEGER)"
+        )
+    )
+    db.execute(
+        text(
+            "INSERT INTO sales (id, sale_date, quantity, item_id) VALUES "
+            "(1, '2025-01-01', 1, 1), (2, '2025-01-01', 2, 2), "
+            "(3, '2025-01-01', 3, 1), (4, '2025-01-02', 4, 2), "
+            "(5, '2025-01-02', 5, 2)"
+        )
+    )
+    db.commit()
+
+    assert delete_duplicate_sales(db) == 2
+    remaining = db.execute(text("SELECT id FROM sales ORDER BY id"))
+    assert remaining.scalars().all() == [1, 2, 4]
+    db.close()
@@ -1,6 +1,9 @@
+import subprocess
+import sys
 import pytest
 from httpx import AsyncClient, ASGITransport, Headers
 
+from authenticate import create_access_token
 from main import app
 
 
@@ -12,3 +15,131 @@ async def test_read_root():
         response = await ac.get("/")
     assert response.status_code == 200
     assert "Прогноз продаж на следующие 20 дней" in response.text
+
+
+@pytest.mark.asyncio
+async def test_jobs_require_admin():
+    async with AsyncClient(
+        transport=ASGITransport(app), base_url="http://testserver"
+    ) as ac:
+        response = await ac.post("/jobs/retrain")
+        assert response.status_code == 403
+        response = await ac.get("/jobs/pending")
+        assert response.status_code == 403
+
+
+def test_main_import_does_not_load_forecasting_backend():
+    code = (
+        "import sys, main; "
+        "assert 'forecasting' not in sys.modules; "
+        "assert 'pandas' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+@pytest.mark.asyncio
+async def test_bulk_sales_requires_admin():
+    async with AsyncClient(
+        transport=ASGITransport(app), base_url="http://testserver"
+    ) as ac:
+        response = await ac.post(
+            "/sales/bulk", content=b"sale_date,item_id,quantity\n"
+        )
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_sales_api_requires_admin_and_rejects_bad_cursor():
+    token = create_access_token({"sub": "sales_admin", "roles": ["admin"]})
+    async with AsyncClient(
+        transport=ASGITransport(app), base_url="http://testserver"
+    ) as ac:
+        response = await ac.get("/api/sales", params={"item_id": 1})
+        assert response.status_code == 403
+        ac.cookies.set("access_token", token)
+        response = await ac.get("/api/sales", params={"cursor": "bad"})
+        assert response.status_code == 400
+        response = await ac.get("/api/sales", params={"item_id": 1})
+    assert response.status_code == 200
+    assert set(response.json()) == {"items", "next_cursor"}
+
+
+@pytest.mark.asyncio
+async def test_forecast_api_answers_304_for_matching_etag(monkeypatch):
+    from backends import forecast_backend
+
+    calls = []
+
+    def item_forecasts(db, item_ids, forecast_days=None):
+        calls.append(item_ids)
+        return [{"item_id": 1, "date": "2025-01-01", "predicted_quantity": 2}]
+
+    monkeypatch.setattr(
+        forecast_backend,
+        "item_versions",
+        lambda db, item_ids: {item_id: "v1" for item_id in item_ids},
+    )
+    monkeypatch.setattr(forecast_backend, "item_forecasts", item_forecasts)
+
+    async with AsyncClient(
+        transport=ASGITransport(app), base_url="http://testserver"
+    ) as ac:
+        response = await ac.get("/api/forecast", params={"item_id": 1})
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        assert etag.startswith('"')
+
+        response = await ac.get(
+            "/api/forecast",
+            params={"item_id": 1},
+            headers={"If-None-Match": etag},
+        )
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+
+        response = await ac.get(
+            "/api/forecast",
+            params={"item_id": 1, "days": 5},
+            headers={"If-None-Match": etag},
+        )
+        assert response.status_code == 200
+    assert calls == [[1], [1]]
+
+
+@pytest.mark.asyncio
+async def test_metrics_report_route_latency():
+    async with AsyncClient(
+        transport=ASGITransport(app), base_url="http://testserver"
+    ) as ac:
+        await ac.get("/jobs/pending")
+        response = await ac.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert (
+        'http_request_duration_seconds_count{method="GET",'
+        'route="/jobs/pending",status="403"}' in response.text
+    )
+
+
+@pytest.mark.asyncio
+async def test_export_requires_admin_and_streams_csv():
+    token = create_access_token({"sub": "export_admin", "roles": ["admin"]})
+    async with AsyncClient(
+        transport=ASGITransport(app), base_url="http://testserver"
+    ) as ac:
+        response = await ac.get("/api/export/sales")
+        assert response.status_code == 403
+        response = await ac.get(
+            "/api/export/sales",
+            params={"gzip": "true"},
+            cookies={"access_token": token},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.text.splitlines()[0] == "item_id,sale_date,quantity"
+        response = await ac.get(
+            "/api/export/sales",
+            params={"format": "xlsx"},
+            cookies={"access_token": token},
+        )
+        assert response.status_code == 400
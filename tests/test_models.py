@@ -3,6 +3,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import Base, Sale
 from datetime import date
+from database import async_database_url
 
 
 @pytest.fixture(scope="module")
@@ -24,3 +25,17 @@ def test_sale_model(test_db):
     fetched_sale = test_db.query(Sale).filter_by(item_id=1).first()
     assert fetched_sale is not None
     assert fetched_sale.quantity == 5
+
+
+def test_async_database_url():
+    assert (
+        async_database_url("postgresql://user:pass@db:5432/sales")
+        == "postgresql+asyncpg://user:pass@db:5432/sales"
+    )
+    assert (
+        async_database_url("postgresql+psycopg2://user@db/sales")
+        == "postgresql+asyncpg://user@db/sales"
+    )
+    assert (
+        async_database_url("sqlite:///app.db") == "sqlite+aiosqlite:///app.db"
+    )
@@ -0,0 +1,24 @@
+import asyncio
+import pytest
+from passwords import PasswordHasher, PasswordPoolBusy
+
+
+@pytest.mark.asyncio
+async def test_hash_and_verify_run_in_pool():
+    hasher = PasswordHasher(workers=2, queue_limit=4, rounds=4)
+    password_hash = await hasher.hash("secret")
+    assert password_hash.startswith("$2b$04$")
+    assert await hasher.verify("secret", password_hash)
+    assert not await hasher.verify("wrong", password_hash)
+    assert hasher.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_limit_rejects_overload():
+    hasher = PasswordHasher(workers=1, queue_limit=2, rounds=10)
+    results = await asyncio.gather(
+        *(hasher.hash("secret") for _ in range(4)), return_exceptions=True
+    )
+    busy = [r for r in results if isinstance(r, PasswordPoolBusy)]
+    assert len(busy) == 2
+    assert hasher.pending == 0
@@ -0,0 +1,108 @@
+from datetime import date, timedelta
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from models import Base, Sale
+from sales_history import sales_page, sales_page_query
+
+
+@pytest.fixture
+async def history_db():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    async with session_factory() as db:
+        start = date(2025, 1, 1)
+        db.add_all(
+            Sale(
+                sale_date=start + timedelta(days=day),
+                item_id=item_id,
+                quantity=item_id * 100 + day,
+            )
+            for item_id in (1, 2, 3)
+            for day in range(25)
+        )
+        await db.commit()
+        yield db
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_keyset_pages_cover_history_once(history_db):
+    rows, cursor = [], None
+    while True:
+        page = await sales_page(history_db, limit=7, cursor=cursor)
+        rows.extend(page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    keys = [(row["item_id"], row["sale_date"]) for row in rows]
+    assert len(keys) == 75
+    assert keys == sorted(set(keys))
+
+
+@pytest.mark.asyncio
+async def test_item_range_descending(history_db):
+    page = await sales_page(
+        history_db,
+        limit=3,
+        item_id=2,
+        date_from=date(2025, 1, 10),
+        date_to=date(2025, 1, 20),
+        descending=True,
+    )
+    assert [row["sale_date"] for row in page["items"]] == [
+        "2025-01-20",
+        "2025-01-19",
+        "2025-01-18",
+    ]
+    page = await sales_page(
+        history_db,
+        limit=3,
+        item_id=2,
+        date_from=date(2025, 1, 10),
+        date_to=date(2025, 1, 20),
+        descending=True,
+        cursor=page["next_cursor"],
+    )
+    assert page["items"][0]["sale_date"] == "2025-01-17"
+    assert all(row["item_id"] == 2 for row in page["items"])
+
+
+@pytest.mark.asyncio
+async def test_item_history_uses_item_date_index(history_db):
+    query = sales_page_query(item_id=2, date_from=date(2025, 1, 10))
+    compiled = query.compile(
+        dialect=history_db.bind.dialect,
+        compile_kwargs={"literal_binds": True},
+    )
+    result = await history_db.execute(
+        text(f"EXPLAIN QUERY PLAN {compiled}")
+    )
+    plan = " ".join(str(row[-1]) for row in result)
+    assert "ix_sales_item_id_sale_date" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_index_migration_is_idempotent(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'migrate.db'}"
+    monkeypatch.setenv("DATABASE_URL", url)
+    config = Config("alembic.ini")
+
+    # Без таблиц миграция ничего не делает
+    command.upgrade(config, "head")
+    command.downgrade(config, "base")
+
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_sales_item_id_sale_date"))
+    command.upgrade(config, "head")
+    indexes = {index["name"] for index in inspect(engine).get_indexes("sales")}
+    assert "ix_sales_item_id_sale_date" in indexes
+    engine.dispose()
@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+import threading
+import time
+
+from singleflight import SingleFlight
+
+
+def run_concurrently(target, count):
+    threads = [
+        threading.Thread(target=target, args=(i,)) for i in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_callers_compute_once(tmp_path):
+    flights = SingleFlight(tmp_path)
+    cache = {}
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        cache["value"] = 42
+        return 42
+
+    results = [None] * 8
+
+    def caller(i):
+        results[i] = flights.run("item_1", lambda: cache.get("value"), compute)
+
+    run_concurrently(caller, 8)
+    assert len(calls) == 1
+    assert results == [42] * 8
+
+
+def test_instances_sharing_directory_compute_once(tmp_path):
+    # Отдельные экземпляры не делят threading.Lock, как воркеры uvicorn,
+    # поэтому их держит только файловая блокировка
+    cache = {}
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        cache["value"] = 7
+        return 7
+
+    def caller(i):
+        SingleFlight(tmp_path).run(
+            "item_1", lambda: cache.get("value"), compute
+        )
+
+    run_concurrently(caller, 4)
+    assert len(calls) == 1
+
+
+def test_different_keys_do_not_wait(tmp_path):
+    flights = SingleFlight(tmp_path)
+    finished = {}
+
+    def caller(i):
+        def compute():
+            time.sleep(0.3)
+            finished[i] = time.monotonic()
+            return i
+
+        flights.run(f"item_{i}", lambda: None, compute)
+
+    started = time.monotonic()
+    run_concurrently(caller, 4)
+    assert max(finished.values()) - started < 1.0
+
+
+def test_timeout_falls_back_to_computing(tmp_path):
+    holder = SingleFlight(tmp_path)
+    waiter = SingleFlight(tmp_path, timeout=0.2)
+    with holder.lock("item_1"):
+        assert waiter.run("item_1", lambda: None, lambda: "own") == "own"
+
+
+def _process_caller(directory, barrier):
+    result_path = os.path.join(directory, "result")
+
+    def fetch():
+        if not os.path.exists(result_path):
+            return None
+        with open(result_path) as f:
+            return f.read()
+
+    def compute():
+        with open(os.path.join(directory, "calls"), "a") as f:
+            f.write("call\n")
+        time.sleep(0.3)
+        with open(result_path, "w") as f:
+            f.write("forecast")
+        return "forecast"
+
+    barrier.wait()
+    assert SingleFlight(directory).run("item_1", fetch, compute) == "forecast"
+
+
+def test_worker_processes_compute_once(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(4)
+    processes = [
+        context.Process(target=_process_caller, args=(str(tmp_path), barrier))
+        for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+    assert [process.exitcode for process in processes] == [0] * 4
+    with open(tmp_path / "calls") as f:
+        assert f.read().splitlines() == ["call"]
@@ -0,0 +1,159 @@
+from datetime import timedelta
+
+import pandas as pd
+from sqlalchemy import event
+
+import forecasting
+import snapshots
+from forecasting import (
+    ModelRegistry,
+    forecast_with_dynamic_features,
+    format_fingerprint,
+    item_fingerprints,
+    load_sales_frame,
+    load_training_frame,
+)
+from models import Sale, SaleFeature
+from snapshots import (
+    load_snapshot,
+    load_snapshot_frame,
+    read_manifest,
+    sync_snapshot,
+)
+
+
+def history(i, item):
+    return (i * 7 + item) % 11
+
+
+def assert_matches_db(db, path, item_ids=None, lookback_rows=None):
+    pd.testing.assert_frame_equal(
+        load_snapshot_frame(db, item_ids, lookback_rows, path=path),
+        load_sales_frame(db, item_ids, lookback_rows),
+    )
+
+
+def test_snapshot_appends_rows_after_watermark(tmp_path, db, seed_sales):
+    start = seed_sales(items=(1, 2), days=30, quantity=history)
+    assert sync_snapshot(db, tmp_path) == {
+        "appended": 60,
+        "rebuilt": [],
+        "removed": [],
+    }
+    assert read_manifest(tmp_path)["watermark"] == 60
+    assert_matches_db(db, tmp_path)
+    pd.testing.assert_frame_equal(
+        load_training_frame(db, snapshot=tmp_path), load_sales_frame(db)
+    )
+
+    db.add(Sale(sale_date=start + timedelta(days=30), quantity=4, item_id=1))
+    db.commit()
+    # Из БД читается только новая строка, она ложится отдельной частью
+    assert sync_snapshot(db, tmp_path)["appended"] == 1
+    assert len(read_manifest(tmp_path)["items"]["1"]["parts"]) == 2
+    assert_matches_db(db, tmp_path)
+    assert_matches_db(db, tmp_path, [1], lookback_rows=10)
+    assert sync_snapshot(db, tmp_path)["appended"] == 0
+
+
+def test_changed_history_rewrites_item_partition(tmp_path, db, seed_sales):
+    start = seed_sales(items=(1, 2), days=30, quantity=history)
+    sync_snapshot(db, tmp_path)
+
+    sale = db.query(Sale).filter_by(item_id=2, sale_date=start).one()
+    sale.quantity = 100
+    db.add(Sale(sale_date=start - timedelta(days=1), quantity=1, item_id=1))
+    db.query(Sale).filter_by(item_id=1, sale_date=start).delete()
+    db.add(Sale(sale_date=start, quantity=3, item_id=3))
+    db.commit()
+
+    result = sync_snapshot(db, tmp_path)
+    assert result["rebuilt"] == [1, 2]
+    assert_matches_db(db, tmp_path)
+    assert sorted(read_manifest(tmp_path)["items"]) == ["1", "2", "3"]
+
+    db.query(Sale).filter_by(item_id=3).delete()
+    db.commit()
+    assert sync_snapshot(db, tmp_path)["removed"] == [3]
+    assert not (tmp_path / "item_id=3").exists()
+    assert_matches_db(db, tmp_path)
+
+
+def test_small_parts_are_compacted(tmp_path, monkeypatch, db, seed_sales):
+    monkeypatch.setattr(snapshots, "SNAPSHOT_MAX_PARTS", 2)
+    start = seed_sales(items=(1, 2), days=30, quantity=history)
+    sync_snapshot(db, tmp_path)
+    for day in range(30, 33):
+        db.add(
+            Sale(sale_date=start + timedelta(days=day), quantity=1, item_id=1)
+        )
+        db.commit()
+        sync_snapshot(db, tmp_path)
+
+    parts = read_manifest(tmp_path)["items"]["1"]["parts"]
+    assert len(parts) == 2
+    files = sorted(path.name for path in (tmp_path / "item_id=1").iterdir())
+    assert files == sorted(parts)
+    assert_matches_db(db, tmp_path)
+
+
+def test_snapshot_training_skips_feature_store(
+    tmp_path, monkeypatch, db, seed_sales
+):
+    seed_sales(items=(1, 2), days=30, quantity=history)
+    calls = []
+
+    def batched(registry, data, fingerprints, days, seed=None, features=None):
+        calls.append((len(data), features))
+        return []
+
+    monkeypatch.setattr(forecasting, "forecast_with_batched_training", batched)
+    monkeypatch.setattr(forecasting, "USE_FEATURE_STORE", True)
+    forecast_with_dynamic_features(
+        db,
+        ModelRegistry(tmp_path / "models"),
+        mode="batched",
+        snapshot=tmp_path / "snapshot",
+    )
+    # Признаки строятся из кадра снимка, таблица признаков не трогается
+    assert calls == [(60, None)]
+    assert db.query(SaleFeature).count() == 0
+
+
+def captured_statements(db, path):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        return load_snapshot(db, path=path), statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def test_repeat_load_reads_only_new_rows(tmp_path, db, seed_sales):
+    start = seed_sales(items=(1, 2), days=30, quantity=history)
+    sync_snapshot(db, tmp_path)
+    db.add(Sale(sale_date=start + timedelta(days=30), quantity=4, item_id=1))
+    db.add(Sale(sale_date=start, quantity=2, item_id=3))
+    # Продажа задним числом переписывает только свою партицию
+    db.add(Sale(sale_date=start - timedelta(days=1), quantity=5, item_id=2))
+    db.commit()
+
+    (frame, stats), statements = captured_statements(db, tmp_path)
+    # max(id), строки новее водяного знака и история переписанного товара
+    assert len(statements) == 3
+    assert not any("GROUP BY" in statement for statement in statements)
+    pd.testing.assert_frame_equal(frame, load_sales_frame(db))
+    fingerprints = {
+        item_id: format_fingerprint(*item_stats)
+        for item_id, item_stats in stats.items()
+    }
+    assert fingerprints == item_fingerprints(db)
+
+    (frame, _), statements = captured_statements(db, tmp_path)
+    assert len(statements) == 2
+    pd.testing.assert_frame_equal(frame, load_sales_frame(db))
@@ -0,0 +1,306 @@
+import threading
+import time
+from datetime import timedelta
+import pytest
+import forecasting
+import training
+from models import Sale
+from backends import ForecastBackend, LazyBackend
+from forecasting import (
+    ModelRegistry,
+    item_fingerprints,
+    refresh_stale_forecasts,
+)
+from training import TrainingQueue
+
+
+lazy_target = TrainingQueue(autostart=False)
+
+
+def fake_forecasts(forecast):
+    # Подменяет расчёт внутри refresh_stale_forecasts прогнозом по товару
+    def forecast_with_dynamic_features(db_session, registry, **kwargs):
+        return [row for item in kwargs["item_ids"] for row in forecast(item)]
+
+    return forecast_with_dynamic_features
+
+
+def test_dirty_items_are_trained_off_the_read_path(
+    tmp_path, session_factory, db, seed_sales
+):
+    start = seed_sales(quantity=lambda i, item: i % 5)
+
+    registry = ModelRegistry(tmp_path / "models")
+    trainer = TrainingQueue(
+        session_factory, registry, autostart=False, processes=0
+    )
+
+    # Новые продажи только помечают товар, обучает воркер
+    trainer.mark_dirty(1)
+    assert trainer.pending() == [1]
+    assert registry.stats() == {"hits": 0, "misses": 0}
+
+    job = trainer.run_pending()
+    assert job["status"] == "done"
+    assert job["items"] == [1]
+    assert job["training"][1]["epochs"] >= 1
+    assert trainer.pending() == []
+
+    forecasts = trainer.item_forecasts(db, [1])
+    assert len(forecasts) == 20
+    assert {forecast["item_id"] for forecast in forecasts} == {1}
+    assert trainer.pending() == []
+
+    db.add(Sale(sale_date=start + timedelta(days=20), quantity=3, item_id=1))
+    db.commit()
+    trainer.mark_dirty(1)
+    assert trainer.pending() == [1]
+    # Пока новая модель не готова, отдаётся предыдущий прогноз
+    assert trainer.item_forecasts(db, [1]) == forecasts
+    assert registry.stats() == {"hits": 0, "misses": 1}
+
+    job = trainer.enqueue([1])
+    assert trainer.job_status(job["id"])["status"] == "queued"
+    trainer._run_job(job["id"])
+    assert trainer.job_status(job["id"])["status"] == "done"
+    assert registry.stats() == {"hits": 0, "misses": 2}
+
+
+def test_lazy_backend_buffers_writes_until_loaded():
+    backend = LazyBackend("tests.test_training:lazy_target")
+    backend.mark_dirty(5)
+    backend.mark_dirty(3)
+    assert not backend.loaded
+    assert backend.pending() == [3, 5]
+
+    assert backend.load() is lazy_target
+    assert lazy_target.pending() == [3, 5]
+    backend.mark_dirty(7)
+    assert backend.pending() == [3, 5, 7]
+
+
+def test_incomplete_backend_fails_on_creation():
+    class PendingOnly(ForecastBackend):
+        def pending(self):
+            return []
+
+    with pytest.raises(TypeError):
+        PendingOnly()
+
+
+def test_item_forecasts_compute_only_requested_items(
+    tmp_path, session_factory, db, seed_sales
+):
+    start = seed_sales(items=(1, 2), quantity=lambda i, item: (i + item) % 5)
+
+    registry = ModelRegistry(tmp_path / "models")
+    trainer = TrainingQueue(
+        session_factory, registry, autostart=False, processes=0
+    )
+
+    # Прогноза ещё нет, поэтому первый запрос считает его сам
+    versions = trainer.item_versions(db, [2, 9])
+    assert versions[9] is None and versions[2] is not None
+    assert registry.stats() == {"hits": 0, "misses": 1}
+
+    forecasts = trainer.item_forecasts(db, [2, 9])
+    assert len(forecasts) == 20
+    assert {forecast["item_id"] for forecast in forecasts} == {2}
+    assert registry.stats() == {"hits": 0, "misses": 1}
+
+    # Короткий горизонт берётся из готового прогноза без пересчёта
+    assert trainer.item_forecasts(db, [2], 5) == forecasts[:5]
+
+    # Устаревший товар отдаётся с прежней версией и уходит воркеру,
+    # длинный горизонт читается из строк той же версии
+    db.add(Sale(sale_date=start + timedelta(days=20), quantity=4, item_id=2))
+    db.commit()
+    assert trainer.item_versions(db, [2]) == {2: versions[2]}
+    assert trainer.item_forecasts(db, [2]) == forecasts
+    assert trainer.pending() == [2]
+    long_horizon = trainer.item_forecasts(db, [2], 30)
+    assert long_horizon[:20] == forecasts
+    assert long_horizon[0]["date"] == "2025-01-21"
+    assert long_horizon[-1]["date"] == "2025-02-19"
+    assert registry.stats() == {"hits": 0, "misses": 1}
+
+    trainer.run_pending()
+    assert trainer.item_versions(db, [2]) != {2: versions[2]}
+    assert trainer.item_forecasts(db, [2], 30)[0]["date"] == "2025-01-22"
+    assert registry.stats() == {"hits": 0, "misses": 2}
+
+
+def test_workers_compute_a_stale_forecast_once(
+    tmp_path, monkeypatch, session_factory, seed_sales
+):
+    seed_sales(quantity=lambda i, item: i % 5)
+
+    calls = []
+
+    def slow_forecast(item_id):
+        calls.append(item_id)
+        time.sleep(0.3)
+        return [
+            {"item_id": item_id, "date": "2025-01-21", "predicted_quantity": 2}
+        ]
+
+    monkeypatch.setattr(
+        forecasting,
+        "forecast_with_dynamic_features",
+        fake_forecasts(slow_forecast),
+    )
+    # У каждого воркера свои реестр и сессия, общие только БД и каталог
+    workers = [
+        TrainingQueue(
+            session_factory,
+            ModelRegistry(tmp_path / "models"),
+            autostart=False,
+            processes=0,
+        )
+        for _ in range(4)
+    ]
+    results = [None] * len(workers)
+
+    def request(i):
+        session = session_factory()
+        try:
+            results[i] = workers[i].item_forecasts(session, [1])
+        finally:
+            session.close()
+
+    threads = [
+        threading.Thread(target=request, args=(i,))
+        for i in range(len(workers))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert len(results[0]) == 1
+    assert all(result == results[0] for result in results)
+
+
+def test_failing_item_backs_off_and_job_history_is_capped(
+    tmp_path, monkeypatch, session_factory, seed_sales
+):
+    seed_sales(items=(1, 2))
+
+    def flaky_forecast(item_id):
+        if item_id == 2:
+            raise RuntimeError("модель не сошлась")
+        return [
+            {"item_id": item_id, "date": "2025-01-21", "predicted_quantity": 1}
+        ]
+
+    monkeypatch.setattr(
+        forecasting,
+        "forecast_with_dynamic_features",
+        fake_forecasts(flaky_forecast),
+    )
+    monkeypatch.setattr(training, "TRAINING_MAX_RETRIES", 3)
+    monkeypatch.setattr(training, "TRAINING_JOB_HISTORY", 2)
+    now = [0.0]
+    trainer = TrainingQueue(
+        session_factory,
+        ModelRegistry(tmp_path / "models"),
+        autostart=False,
+        processes=0,
+        clock=lambda: now[0],
+    )
+    trainer.mark_dirty(1)
+    trainer.mark_dirty(2)
+
+    job = trainer.run_pending()
+    # Упавший товар не мешает остальным
+    assert job["status"] == "failed"
+    assert job["failed"] == [2]
+    assert "модель не сошлась" in job["error"]
+    assert trainer.pending() == [2]
+
+    # До конца паузы новая задача не создаётся
+    assert trainer.run_pending() is None
+    now[0] += training.TRAINING_RETRY_SECONDS
+    assert trainer.run_pending()["failed"] == [2]
+    now[0] += 2 * training.TRAINING_RETRY_SECONDS
+    assert trainer.run_pending()["failed"] == [2]
+    # Попытки исчерпаны: товар ждёт новых продаж
+    assert trainer.pending() == []
+    now[0] += training.TRAINING_RETRY_MAX_SECONDS
+    assert trainer.run_pending() is None
+    assert len(trainer._jobs) == 2
+
+    trainer.mark_dirty(2)
+    assert trainer.run_pending()["failed"] == [2]
+    assert len(trainer._jobs) == 2
+
+
+def test_feature_store_uses_training_lookback(
+    tmp_path, monkeypatch, session_factory, db, seed_sales
+):
+    seed_sales(days=400)
+    rows = []
+
+    def batched(registry, data, fingerprints, days, seed=None, features=None):
+        X, _, _ = features(1)()
+        rows.append(len(X))
+        return []
+
+    monkeypatch.setattr(forecasting, "forecast_with_batched_training", batched)
+    monkeypatch.setattr(forecasting, "USE_FEATURE_STORE", True)
+    monkeypatch.setattr(forecasting, "TRAINING_LOOKBACK_ROWS", 30)
+    trainer = TrainingQueue(
+        session_factory,
+        ModelRegistry(tmp_path / "models"),
+        autostart=False,
+        processes=0,
+        mode="batched",
+    )
+    trainer.item_versions(db, [1])
+    # Окно в 30 строк минус 14 первых строк без самого длинного лага
+    assert rows == [16]
+
+
+@pytest.mark.parametrize("mode", ["per_item", "batched", "global"])
+def test_queue_and_refresh_agree_on_versions(
+    tmp_path, session_factory, db, seed_sales, mode
+):
+    start = seed_sales(items=(1, 2), quantity=lambda i, item: (i + item) % 5)
+    registry = ModelRegistry(tmp_path / "models")
+    assert refresh_stale_forecasts(db, registry, mode=mode)["stale"] == [1, 2]
+
+    trainer = TrainingQueue(
+        session_factory, registry, autostart=False, mode=mode, processes=0
+    )
+    versions = trainer.item_versions(db, [1, 2])
+    assert trainer.pending() == []
+
+    db.add(Sale(sale_date=start + timedelta(days=20), quantity=3, item_id=1))
+    db.commit()
+    trainer.mark_dirty(1)
+    assert trainer.run_pending()["status"] == "done"
+    assert trainer.item_versions(db, [1, 2])[2] == versions[2]
+    # Записанное очередью refresh_forecasts считает свежим, и наоборот
+    assert refresh_stale_forecasts(db, registry, mode=mode)["stale"] == []
+    assert trainer.item_versions(db, [1, 2]) != versions
+    assert trainer.pending() == []
+
+
+def test_training_runs_outside_the_web_process(
+    tmp_path, session_factory, db, seed_sales
+):
+    seed_sales(quantity=lambda i, item: i % 5)
+    registry = ModelRegistry(tmp_path / "models")
+    trainer = TrainingQueue(
+        session_factory, registry, autostart=False, processes=1
+    )
+    trainer.mark_dirty(1)
+    job = trainer.run_pending()
+    assert job["status"] == "done"
+    assert job["training"][1]["epochs"] >= 1
+    assert len(trainer.item_forecasts(db, [1])) == 20
+    assert trainer.pending() == []
+    # Модель обучил и сохранил процесс пула, а не этот процесс
+    assert registry.stats() == {"hits": 0, "misses": 0}
+    assert registry.load(1, item_fingerprints(db)[1]) is not None
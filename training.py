@@ -0,0 +1,343 @@
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from contextlib import ExitStack
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backends import ForecastBackend
+from database import SessionLocal, pool_options
+from forecast_store import read_forecasts, stale_items, stored_versions
+from forecasting import (
+    FORECAST_DAYS,
+    FORECAST_MODEL_MODE,
+    ModelRegistry,
+    forecast_versions,
+    get_process_pool,
+    item_fingerprints,
+    model_registry,
+    refresh_stale_forecasts,
+)
+
+
+TRAINING_POLL_SECONDS = float(os.environ.get("TRAINING_POLL_SECONDS", "5"))
+# Сколько завершённых задач хранится для /jobs/{id}
+TRAINING_JOB_HISTORY = int(os.environ.get("TRAINING_JOB_HISTORY", "100"))
+# Упавший товар повторяется с удвоением паузы, после TRAINING_MAX_RETRIES
+# попыток он ждёт новых продаж (mark_dirty) или ручного запуска
+TRAINING_MAX_RETRIES = int(os.environ.get("TRAINING_MAX_RETRIES", "5"))
+TRAINING_RETRY_SECONDS = float(os.environ.get("TRAINING_RETRY_SECONDS", "30"))
+TRAINING_RETRY_MAX_SECONDS = 3600
+# Модели обучаются в отдельном процессе: TensorFlow не загружается
+# в веб-воркер и не отнимает CPU у запросов. 0 — обучение в потоке очереди
+TRAINING_PROCESSES = int(os.environ.get("TRAINING_PROCESSES", "1"))
+
+_process_sessions = {}
+_process_registries = {}
+
+
+def refresh_items(db_session, registry, mode, item_ids):
+    # Прогноз товара считает один вызов на все процессы хоста:
+    # остальные ждут блокировку, а refresh_stale_forecasts под ней
+    # заново находит устаревшие товары и пропускает записанные
+    item_ids = sorted(item_ids)
+    for item_id in item_ids:
+        registry.training_reports.pop(item_id, None)
+    db_session.rollback()
+    with ExitStack() as flights:
+        for item_id in item_ids:
+            flights.enter_context(registry.flights.lock(f"forecast_{item_id}"))
+        result = refresh_stale_forecasts(
+            db_session, registry, mode=mode, item_ids=item_ids
+        )
+    result["training"] = {
+        item_id: registry.training_reports[item_id]
+        for item_id in item_ids
+        if item_id in registry.training_reports
+    }
+    return result
+
+
+def _refresh_in_process(database_url, registry_path, mode, item_ids):
+    # Выполняется в процессе пула: соединения и загруженные модели
+    # переиспользуются между задачами
+    if database_url not in _process_sessions:
+        _process_sessions[database_url] = sessionmaker(
+            bind=create_engine(database_url, **pool_options(database_url))
+        )
+    if registry_path not in _process_registries:
+        _process_registries[registry_path] = ModelRegistry(registry_path)
+    db = _process_sessions[database_url]()
+    try:
+        return refresh_items(
+            db, _process_registries[registry_path], mode, item_ids
+        )
+    finally:
+        db.close()
+
+
+class TrainingQueue(ForecastBackend):
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        registry=None,
+        autostart=True,
+        clock=time.monotonic,
+        mode=None,
+        processes=TRAINING_PROCESSES,
+    ):
+        self.session_factory = session_factory
+        self.registry = registry or model_registry
+        # Режим тот же, что у refresh_forecasts: версии прогнозов
+        # совпадают и пути не перезаписывают друг друга
+        self.mode = mode or FORECAST_MODEL_MODE
+        self.processes = processes
+        self.autostart = autostart
+        self.clock = clock
+        self._dirty = set()
+        self._in_flight = set()
+        # item_id -> (число неудачных попыток, время следующей попытки)
+        self._failures = {}
+        self._jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def mark_dirty(self, item_id):
+        with self._lock:
+            # Новые продажи дают упавшему товару свежий набор попыток
+            self._failures.pop(int(item_id), None)
+            self._dirty.add(int(item_id))
+        self._ensure_worker()
+
+    def _given_up(self):
+        return {
+            item_id
+            for item_id, (attempts, _) in self._failures.items()
+            if attempts >= TRAINING_MAX_RETRIES
+        }
+
+    def _ready_items(self):
+        now = self.clock()
+        return {
+            item_id
+            for item_id in self._dirty
+            if item_id not in self._failures
+            or self._failures[item_id][1] <= now
+        }
+
+    def _record_failure(self, item_id):
+        attempts = self._failures.get(item_id, (0, 0))[0] + 1
+        if attempts >= TRAINING_MAX_RETRIES:
+            self._failures[item_id] = (attempts, float("inf"))
+            self._dirty.discard(item_id)
+            return
+        delay = min(
+            TRAINING_RETRY_SECONDS * 2 ** (attempts - 1),
+            TRAINING_RETRY_MAX_SECONDS,
+        )
+        self._failures[item_id] = (attempts, self.clock() + delay)
+        self._dirty.add(item_id)
+
+    def _prune_jobs(self):
+        finished = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job["finished_at"] is not None
+        ]
+        for job_id in finished[: max(len(finished) - TRAINING_JOB_HISTORY, 0)]:
+            del self._jobs[job_id]
+
+    def pending(self):
+        with self._lock:
+            return sorted(self._dirty | self._in_flight)
+
+    def enqueue(self, item_ids=None):
+        job = self._create_job(item_ids)
+        self._queue.put(job["id"])
+        self._ensure_worker()
+        return dict(job)
+
+    def job_status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _stored_versions(self, db_session, item_ids):
+        # В запросе прогноз считается, только если его ещё ни разу
+        # не сохраняли: устаревший отдаётся как есть и уходит воркеру
+        fingerprints = item_fingerprints(db_session, item_ids)
+        versions = stored_versions(db_session, item_ids)
+        missing = sorted(set(fingerprints) - set(versions))
+        if missing:
+            self._refresh(db_session, missing)
+            with self._lock:
+                self._dirty.difference_update(missing)
+            versions = stored_versions(db_session, item_ids)
+
+        stale, removed = stale_items(
+            forecast_versions(self.registry, fingerprints, self.mode),
+            versions,
+        )
+        with self._lock:
+            self._dirty.update(
+                set(stale + removed) - self._in_flight - self._given_up()
+            )
+            has_dirty = bool(self._dirty)
+        if has_dirty:
+            self._ensure_worker()
+        # Прогноз товара без продаж удалит воркер, читателю он не нужен
+        return {
+            item_id: version
+            for item_id, version in versions.items()
+            if item_id in fingerprints
+        }
+
+    def item_versions(self, db_session, item_ids):
+        versions = self._stored_versions(db_session, item_ids)
+        return {item_id: versions.get(item_id) for item_id in item_ids}
+
+    def item_forecasts(self, db_session, item_ids, forecast_days=None):
+        # Хранится весь горизонт API, поэтому ответ любой длины берётся
+        # из строк той же версии, по которой построен ETag
+        versions = self._stored_versions(db_session, item_ids)
+        return read_forecasts(
+            db_session, sorted(versions), forecast_days or FORECAST_DAYS
+        )
+
+    def _refresh(self, db_session, item_ids):
+        if not self.processes:
+            return refresh_items(
+                db_session, self.registry, self.mode, item_ids
+            )
+
+        # Веб-процесс только ждёт результат, пока процесс пула обучает
+        # модели и пишет прогнозы в ту же БД и тот же реестр
+        db_session.rollback()
+        bind = self.session_factory.kw["bind"]
+        return (
+            get_process_pool(self.processes)
+            .submit(
+                _refresh_in_process,
+                bind.url.render_as_string(hide_password=False),
+                str(self.registry.path),
+                self.mode,
+                sorted(item_ids),
+            )
+            .result()
+        )
+
+    def run_pending(self):
+        with self._lock:
+            has_ready = bool(self._ready_items())
+        if not has_ready:
+            return None
+        job = self._create_job(None)
+        self._run_job(job["id"])
+        return self.job_status(job["id"])
+
+    def _create_job(self, item_ids):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if item_ids is None:
+                items = sorted(self._ready_items())
+            else:
+                items = sorted({int(item_id) for item_id in item_ids})
+                # Ручной запуск снимает паузу после ошибок
+                for item_id in items:
+                    self._failures.pop(item_id, None)
+                self._dirty.update(items)
+            job = {
+                "id": job_id,
+                "status": "queued",
+                "items": items,
+                "created_at": datetime.utcnow().isoformat(),
+                "finished_at": None,
+                "error": None,
+                "failed": [],
+                # Эпохи и время обучения по товарам для настройки бюджета
+                "training": {},
+            }
+            self._jobs[job_id] = job
+        return job
+
+    def _run_job(self, job_id):
+        with self._lock:
+            job = self._jobs[job_id]
+            items = [item for item in job["items"] if item in self._dirty]
+            self._dirty.difference_update(items)
+            self._in_flight.update(items)
+            job["status"] = "running"
+
+        # По товарам считается только режим per_item, так ошибка одного
+        # товара не мешает остальным. Пакетный и глобальный режимы
+        # обучают все товары задачи вместе
+        if self.mode == "per_item":
+            groups = [[item_id] for item_id in items]
+        else:
+            groups = [items] if items else []
+
+        db = self.session_factory()
+        errors = {}
+        try:
+            for group in groups:
+                try:
+                    result = self._refresh(db, group)
+                except Exception:
+                    db.rollback()
+                    error = traceback.format_exc()
+                    with self._lock:
+                        for item_id in group:
+                            errors[item_id] = error
+                            self._in_flight.discard(item_id)
+                            self._record_failure(item_id)
+                    continue
+                with self._lock:
+                    for item_id in group:
+                        self._in_flight.discard(item_id)
+                        self._failures.pop(item_id, None)
+                    job["training"].update(result["training"])
+            status = "failed" if errors else "done"
+            error = next(iter(errors.values()), None)
+        except Exception:
+            status, error = "failed", traceback.format_exc()
+        finally:
+            db.close()
+
+        with self._lock:
+            # Товары, не успевшие обучиться, возвращаются в очередь
+            self._dirty.update(self._in_flight.intersection(items))
+            self._in_flight.difference_update(items)
+            job["status"] = status
+            job["error"] = error
+            job["failed"] = sorted(errors)
+            job["finished_at"] = datetime.utcnow().isoformat()
+            self._prune_jobs()
+
+    def _ensure_worker(self):
+        if not self.autostart:
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(
+                target=self._work, name="training-worker", daemon=True
+            )
+            self._worker.start()
+
+    def _work(self):
+        while True:
+            try:
+                job_id = self._queue.get(timeout=TRAINING_POLL_SECONDS)
+            except queue.Empty:
+                self.run_pending()
+                continue
+            self._run_job(job_id)
+
+
+training_queue = TrainingQueue()